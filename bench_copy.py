@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# every scenario runs in its own process, so each one starts from empty
+# metrics and its peak memory is its own
+SCENARIOS = ("protected", "text", "albums", "forward", "import")
+
+
+def configure(work_dir):
+    # set before pccs is imported, its settings are read at import time. the
+    # other settings keep their defaults unless they are set in the environment
+    # (e.g. SCAN_MODE=history or INDEX_PATH= to scan without the index)
+    settings = {
+        "PRODUCTION": "1",
+        "INDEX_PATH": os.path.join(work_dir, "index.sqlite3"),
+        "UPLOAD_CACHE_PATH": os.path.join(work_dir, "uploads.sqlite3"),
+        "JOURNAL_DIR": os.path.join(work_dir, "jobs"),
+        "SCRATCH_DIR": os.path.join(work_dir, "downloads"),
+        "TRACE_PATH": os.path.join(work_dir, "trace.jsonl"),
+        "MASTER_CHAT_USERNAME": "me",
+    }
+    for key, value in settings.items():
+        os.environ.setdefault(key, value)
+
+
+def fill_channel(fake, chat, args, text_share, album_share=0.0):
+    # a deterministic mix of text, photos and videos, a share of the media
+    # comes in albums of 2 to 10 items
+    messages = []
+    group = 0
+    while len(messages) < args.messages:
+        roll = fake.random.random()
+        if roll < text_share:
+            messages.append(fake.add_message(chat, "text", caption="some text"))
+        elif fake.random.random() < album_share:
+            group += 1
+            for _ in range(fake.random.randint(2, 10)):
+                kind = "video" if fake.random.random() < 0.5 else "photo"
+                size = args.video_size if kind == "video" else args.photo_size
+                messages.append(
+                    fake.add_message(
+                        chat, kind, size, caption="album", media_group_id=str(group)
+                    )
+                )
+        else:
+            kind = "video" if fake.random.random() < 0.5 else "photo"
+            size = args.video_size if kind == "video" else args.photo_size
+            messages.append(fake.add_message(chat, kind, size, caption="media"))
+    return messages
+
+
+async def run_scenario(name, args, work_dir):
+    import metrics
+    import pccs
+    from fake_telegram import FakeClient, FakeMessage
+    from session_pool import SessionPool
+
+    fake = FakeClient(
+        latency=args.latency,
+        bandwidth=args.bandwidth,
+        flood_rate=args.flood_rate,
+        flood_seconds=args.flood_seconds,
+    )
+    copier = pccs.ChannelCopier()
+    copier.app = fake
+    copier.sessions = SessionPool(fake)
+    fake.limiter.flood_listeners.append(copier.concurrency.flood)
+    copier.sessions.started.set()
+
+    master = fake.add_chat("master", protected=False)
+    src = fake.add_chat("source", protected=name != "forward", link="src")
+    fake.add_chat("destination", protected=False, link="dest")
+    shares = {
+        "protected": (0.4, 0.0),
+        "text": (0.95, 0.0),
+        "albums": (0.1, 0.9),
+        "forward": (0.4, 0.0),
+        "import": (0.4, 0.2),
+    }
+    messages = fill_channel(fake, src, args, *shares[name])
+    command = FakeMessage(fake, master.id, 1)
+
+    started = time.perf_counter()
+    if name == "import":
+        path = os.path.join(work_dir, "source" + pccs.export_format.SUFFIX)
+        with pccs.export_format.ExportWriter(path, "source") as writer:
+            for message in messages:
+                writer.write(message)
+        command.document = fake.add_document(path)
+        started = time.perf_counter()
+        await copier.file_to_channel(command)
+    else:
+        await copier.copy_content(command, "src", [None, None], ["dest"], False)
+    elapsed = time.perf_counter() - started
+
+    items = sum(metrics.items.values.values())
+    if name == "import":  # text messages are items of an import as well
+        items = sum(1 for m in messages if m.text) + items
+    calls = sum(fake.calls.values())
+    return {
+        "scenario": name,
+        "messages": len(messages),
+        "items": items,
+        "seconds": elapsed,
+        "items_per_second": items / elapsed if elapsed else None,
+        "bytes_downloaded": sum(metrics.bytes_downloaded.values.values()),
+        "bytes_uploaded": sum(metrics.bytes_uploaded.values.values()),
+        "bytes_per_second": (
+            sum(metrics.bytes_uploaded.values.values()) / elapsed if elapsed else None
+        ),
+        "api_calls": calls,
+        "api_calls_per_item": calls / items if items else None,
+        "calls_by_method": fake.calls,
+        "items_by_result": {k[0]: v for k, v in metrics.items.values.items()},
+        "flood_waits": sum(metrics.flood_waits.values.values()),
+        # kilobytes on linux
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    }
+
+
+def run_child(args):
+    with tempfile.TemporaryDirectory() as work_dir:
+        configure(work_dir)
+        # the copier prints every item, only the result goes to stdout
+        real_stdout = sys.stdout
+        sys.stdout = open(os.devnull, "w")
+        try:
+            result = asyncio.run(run_scenario(args.scenario, args, work_dir))
+        finally:
+            sys.stdout.close()
+            sys.stdout = real_stdout
+    print(json.dumps(result))
+
+
+def run_parent(args):
+    results = []
+    for name in args.scenarios:
+        command = [sys.executable, os.path.abspath(__file__), "--scenario", name]
+        for option in (
+            "messages",
+            "latency",
+            "bandwidth",
+            "video_size",
+            "photo_size",
+            "flood_rate",
+            "flood_seconds",
+        ):
+            value = getattr(args, option)
+            if value is not None:
+                command += ["--" + option.replace("_", "-"), str(value)]
+
+        output = subprocess.run(
+            command,
+            check=True,
+            stdout=subprocess.PIPE,
+            text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        results.append(result)
+        print(
+            f"{name}: {result['items']} items in {result['seconds']:.2f}s, "
+            f"{result['items_per_second']:.1f} items/s, "
+            f"{result['bytes_per_second'] / 1024 / 1024:.1f} MB/s, "
+            f"{result['api_calls_per_item'] or 0:.2f} calls/item, "
+            f"{result['flood_waits']} flood waits, "
+            f"peak RSS {result['peak_rss_mb']:.0f} MB"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "settings": {
+                        key: value
+                        for key, value in vars(args).items()
+                        if key not in ("scenario", "scenarios", "output")
+                    },
+                    "environment": {
+                        key: os.environ[key]
+                        for key in (
+                            "DOWNLOAD_WORKERS",
+                            "UPLOAD_WORKERS",
+                            "PIPELINE_BUFFER",
+                            "FORWARD_CHUNK",
+                            "SCAN_MODE",
+                            "INDEX_PATH",
+                            "STREAM_MEMORY_CAP",
+                            "PARALLEL_UPLOAD_SIZE",
+                        )
+                        if key in os.environ
+                    },
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+        print(f"results saved to {args.output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="benchmark the copy paths against an in-memory Telegram"
+    )
+    parser.add_argument(
+        "scenarios",
+        nargs="*",
+        default=SCENARIOS,
+        help=f"the scenarios to run, of {', '.join(SCENARIOS)}",
+    )
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument(
+        "--latency", type=float, default=0.002, help="seconds added to every call"
+    )
+    parser.add_argument(
+        "--bandwidth", type=float, default=None, help="bytes per second of transfers"
+    )
+    parser.add_argument("--video-size", type=int, default=5 * 1024 * 1024)
+    parser.add_argument("--photo-size", type=int, default=200 * 1024)
+    parser.add_argument(
+        "--flood-rate",
+        type=float,
+        default=0.0,
+        help="share of send and forward calls answered with a FloodWait",
+    )
+    parser.add_argument("--flood-seconds", type=int, default=1)
+    parser.add_argument("--output", help="a JSON file to save the results to")
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario:
+        run_child(args)
+        return
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios {', '.join(sorted(unknown))}")
+    run_parent(args)
+
+
+if __name__ == "__main__":
+    main()
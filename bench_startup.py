@@ -0,0 +1,81 @@
+import argparse
+import os
+import subprocess
+import sys
+import threading
+import time
+
+READY_LINE = "Listening for commands here"
+
+
+def time_import():
+    # a clean environment, importing must neither fail nor start anything
+    env = {"PATH": os.environ.get("PATH", ""), "PRODUCTION": "1"}
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", "import pccs"],
+        env=env,
+        check=True,
+        timeout=60,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    return time.perf_counter() - started
+
+
+def time_startup(timeout):
+    # the time until the bot has greeted the master, needs real credentials
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-u", "pccs.py"],
+        stdout=subprocess.PIPE,
+        text=True,
+        cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    # a silent hang would block the reads, so the process is killed on time
+    timer = threading.Timer(timeout, process.kill)
+    timer.start()
+    try:
+        for line in process.stdout:
+            if line.strip() == READY_LINE:
+                return time.perf_counter() - started
+        return None
+    finally:
+        timer.cancel()
+        process.terminate()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="measure how fast pccs starts")
+    parser.add_argument(
+        "--import-budget", type=float, default=3, help="seconds allowed to import"
+    )
+    parser.add_argument(
+        "--budget", type=float, default=15, help="seconds allowed to be ready"
+    )
+    parser.add_argument(
+        "--import-only",
+        action="store_true",
+        help="skip the full start, it logs in with the .env credentials",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    import_time = time_import()
+    print(f"import: {import_time:.2f}s (budget {args.import_budget}s)")
+    failed |= import_time > args.import_budget
+
+    if not args.import_only:
+        startup_time = time_startup(args.budget)
+        if startup_time is None:
+            print(f"ready: not within {args.budget}s")
+            failed = True
+        else:
+            print(f"ready: {startup_time:.2f}s (budget {args.budget}s)")
+            failed |= startup_time > args.budget
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+import asyncio
+import time
+
+
+class ConcurrencyController:
+    """
+    an AIMD limit on the transfers running at the same time
+
+    the items completed are counted over windows of `window` seconds, the
+    limit grows by one after a window whose throughput beat the previous one
+    by `tolerance`, and goes back one step if the last raise did not pay off.
+    a FloodWait of one of `method_classes` halves the limit at once and the
+    next window only measures the new baseline. holders above a lowered limit
+    finish their transfer, new ones wait until the count is under it.
+    """
+
+    def __init__(
+        self,
+        initial,
+        minimum=1,
+        maximum=8,
+        window=10,
+        tolerance=0.05,
+        method_classes=("download", "upload"),
+    ):
+        self.minimum = max(1, minimum)
+        self.maximum = max(self.minimum, maximum)
+        self.limit = min(max(initial, self.minimum), self.maximum)
+        self.window = window
+        self.tolerance = tolerance
+        self.method_classes = method_classes
+
+        self.in_use = 0
+        self.changed = asyncio.Condition()
+        self.window_start = time.monotonic()
+        self.completions = 0
+        self.last_rate = None  # items per second of the previous window
+        self.raised = False  # the limit was raised after the previous window
+        self.flood_waits = 0
+
+    async def acquire(self):
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.in_use < self.limit)
+            self.in_use += 1
+
+    async def release(self):
+        async with self.changed:
+            self.in_use -= 1
+            self.changed.notify_all()
+
+    def completed(self, count=1):
+        self.completions += count
+        now = time.monotonic()
+        if now - self.window_start >= self.window:
+            self._adjust(self.completions / (now - self.window_start))
+            self.window_start = now
+            self.completions = 0
+
+    def _adjust(self, rate):
+        if self.last_rate is None:
+            self.raised = False
+        elif rate > self.last_rate * (1 + self.tolerance):
+            self.raised = self.limit < self.maximum
+            self._set_limit(self.limit + 1)
+        elif self.raised and rate < self.last_rate:
+            self.raised = False
+            self._set_limit(self.limit - 1)
+        else:
+            self.raised = False
+        self.last_rate = rate
+
+    def flood(self, method_class, seconds):
+        # a RateLimiter listener, a FloodWait of a transfer cuts the limit in half
+        if method_class not in self.method_classes:
+            return
+        self.flood_waits += 1
+        self._set_limit(self.limit // 2)
+        self.last_rate = None
+        self.raised = False
+        self.window_start = time.monotonic()
+        self.completions = 0
+
+    def _set_limit(self, limit):
+        limit = min(max(limit, self.minimum), self.maximum)
+        if limit == self.limit:
+            return
+        print(f"transfer concurrency {self.limit} -> {limit}")
+        self.limit = limit
+        # a raised limit lets waiting transfers start, the condition can only
+        # be notified with its lock held, so that is done from a task
+        asyncio.get_running_loop().create_task(self._notify())
+
+    async def _notify(self):
+        async with self.changed:
+            self.changed.notify_all()
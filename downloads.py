@@ -0,0 +1,112 @@
+import asyncio
+import math
+import os
+
+from pyrogram.errors import FloodPremiumWait, FloodWait
+
+CHUNK_SIZE = 1024 * 1024  # the part size of stream_media
+RANGE_CHUNKS = 8
+
+
+class RangedDownloader:
+    """
+    downloads one file as byte ranges fetched at the same time
+
+    every range is streamed on its own media connection and written at its
+    offset in a file allocated to the full size upfront. a range that breaks
+    off is resumed from its last complete chunk, and the file is only
+    returned once every range delivered exactly its expected bytes.
+    """
+
+    def __init__(self, client, file_id, file_size, path, workers=4, retries=3):
+        self.client = client
+        self.file_id = file_id
+        self.file_size = file_size
+        self.path = path
+        self.workers_count = workers
+        self.retries = retries
+
+        self.total_chunks = math.ceil(file_size / CHUNK_SIZE)
+        # (first chunk, chunks count) of every range
+        self.ranges = [
+            (start, min(RANGE_CHUNKS, self.total_chunks - start))
+            for start in range(0, self.total_chunks, RANGE_CHUNKS)
+        ]
+        self.received = {}  # first chunk of a range -> bytes written
+
+    def _expected(self, start, count):
+        return min(count * CHUNK_SIZE, self.file_size - start * CHUNK_SIZE)
+
+    async def _fetch(self, fd, start, count):
+        # streams the chunks of the range not written yet, returns when the
+        # stream ends, complete or not
+        done = self.received.get(start, 0) // CHUNK_SIZE
+        position = (start + done) * CHUNK_SIZE
+        range_end = min((start + count) * CHUNK_SIZE, self.file_size)
+        async for chunk in self.client.stream_media(
+            self.file_id, offset=start + done, limit=count - done
+        ):
+            # only the last chunk of the file may be short
+            end = min(position + CHUNK_SIZE, self.file_size)
+            if position >= range_end or position + len(chunk) != end:
+                raise ValueError(
+                    f"chunk at {position} of {self.file_id} has {len(chunk)} bytes,"
+                    f" {end - position} were expected"
+                )
+            await asyncio.to_thread(os.pwrite, fd, chunk, position)
+            position += len(chunk)
+            self.received[start] = self.received.get(start, 0) + len(chunk)
+
+    async def _download_range(self, fd, start, count):
+        expected = self._expected(start, count)
+        failures = 0
+        while self.received.get(start, 0) < expected:
+            try:
+                await self._fetch(fd, start, count)
+            except (FloodWait, FloodPremiumWait) as e:
+                await asyncio.sleep(e.value)
+                continue
+            except (ConnectionError, TimeoutError) as e:
+                print(f"range at chunk {start} of {self.file_id} broke off: {e}")
+
+            if self.received.get(start, 0) < expected:
+                failures += 1
+                if failures > self.retries:
+                    raise ConnectionError(
+                        f"range at chunk {start} of {self.file_id} stopped at "
+                        f"{self.received.get(start, 0)} of {expected} bytes"
+                    )
+
+    async def _worker(self, fd, queue):
+        while not queue.empty():
+            start, count = queue.get_nowait()
+            await self._download_range(fd, start, count)
+
+    async def download(self):
+        queue = asyncio.Queue()
+        for file_range in self.ranges:
+            queue.put_nowait(file_range)
+
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            os.ftruncate(fd, self.file_size)
+            workers = [
+                asyncio.create_task(self._worker(fd, queue))
+                for _ in range(min(self.workers_count, len(self.ranges)))
+            ]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                for worker in workers:
+                    worker.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+        finally:
+            os.close(fd)
+
+        received = sum(self.received.values())
+        if received != self.file_size or os.path.getsize(self.path) != self.file_size:
+            raise ValueError(
+                f"{self.path} has {os.path.getsize(self.path)} bytes, "
+                f"{received} were received of {self.file_size}"
+            )
+        return self.path
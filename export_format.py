@@ -0,0 +1,127 @@
+import gzip
+import json
+
+# a gzip compressed JSON Lines file, a header line then one record per message:
+# {"id", "kind", "file_id", "file_unique_id", "file_size", "caption", "duration",
+#  "thumb_id", "thumb_unique_id", "media_group_id"}
+# where kind is video, photo, document, audio or text (the text is kept in caption)
+FORMAT = "pccs-export"
+VERSION = 1
+SUFFIX = "-history.jsonl.gz"
+KINDS = ("video", "photo", "document", "audio")
+
+
+def message_record(message):
+    for kind in KINDS:
+        media = getattr(message, kind, None)
+        if media:
+            thumbs = getattr(media, "thumbs", None)
+            return {
+                "id": message.id,
+                "kind": kind,
+                "file_id": media.file_id,
+                "file_unique_id": media.file_unique_id,
+                "file_size": media.file_size,
+                "caption": message.caption,
+                "duration": getattr(media, "duration", None),
+                "thumb_id": thumbs[0].file_id if thumbs else None,
+                "thumb_unique_id": thumbs[0].file_unique_id if thumbs else None,
+                "media_group_id": message.media_group_id,
+            }
+
+    if message.text:
+        return {
+            "id": message.id,
+            "kind": "text",
+            "file_id": None,
+            "file_unique_id": None,
+            "file_size": None,
+            "caption": message.text,
+            "duration": None,
+            "thumb_id": None,
+            "thumb_unique_id": None,
+            "media_group_id": None,
+        }
+
+
+class ExportWriter:
+    def __init__(self, path, title):
+        self.path = path
+        self.title = title
+        self.count = 0
+
+    def __enter__(self):
+        self.file = gzip.open(self.path, "wt", encoding="utf-8")
+        self._write({"format": FORMAT, "version": VERSION, "title": self.title})
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+    def _write(self, record):
+        self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def write(self, message):
+        record = message_record(message)
+        if record is not None:
+            self._write(record)
+            self.count += 1
+
+
+def read_records(path):
+    # yields the records one by one, raises ValueError for a foreign file
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        if header.get("format") != FORMAT:
+            raise ValueError(f"{path} is not a {FORMAT} file")
+
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def record_message(record):
+    # a Message carrying what file_to_channel needs, the fields the record
+    # does not have are left empty. files exported before the unique ids were
+    # kept use the file id in their place, the caches are keyed on them
+    from pyrogram import types  # the writer and reader work without pyrogram
+
+    kind = record["kind"]
+    if kind == "text":
+        return types.Message(id=record["id"], text=record["caption"])
+
+    thumbs = None
+    if record["thumb_id"]:
+        thumbs = [
+            types.Thumbnail(
+                file_id=record["thumb_id"],
+                file_unique_id=record.get("thumb_unique_id") or record["thumb_id"],
+                width=0,
+                height=0,
+                file_size=0,
+            )
+        ]
+
+    common = {
+        "file_id": record["file_id"],
+        "file_unique_id": record.get("file_unique_id") or record["file_id"],
+        "file_size": record.get("file_size"),
+    }
+    if kind == "video":
+        media = types.Video(
+            **common, width=0, height=0, duration=record["duration"], thumbs=thumbs
+        )
+    elif kind == "photo":
+        media = types.Photo(**common, width=0, height=0, date=None)
+    elif kind == "audio":
+        media = types.Audio(**common, duration=record["duration"], thumbs=thumbs)
+    else:
+        media = types.Document(**common, thumbs=thumbs)
+
+    # media_group_id is missing from the files exported before albums were kept
+    return types.Message(
+        id=record["id"],
+        caption=record["caption"],
+        media_group_id=record.get("media_group_id"),
+        **{kind: media},
+    )
@@ -0,0 +1,449 @@
+import asyncio
+import io
+import math
+import os
+import random
+import shutil
+from types import SimpleNamespace
+
+from pyrogram import enums, raw, types
+from pyrogram.client import Cache
+from pyrogram.errors import FloodWait
+
+from rate_limiter import METHOD_CLASSES, RateLimiter
+
+CHUNK_SIZE = 1024 * 1024
+# the media kinds of the messages.Search filters, None for every message
+SEARCH_FILTERS = {
+    raw.types.InputMessagesFilterPhotoVideo: ("photo", "video"),
+    raw.types.InputMessagesFilterVideo: ("video",),
+    raw.types.InputMessagesFilterPhotos: ("photo",),
+}
+
+
+class FakeParser:
+    async def parse(self, text, mode=None):
+        return {"message": text, "entities": None}
+
+
+class FakeMessage:
+    """a message of the master chat, replies and edits only count calls"""
+
+    def __init__(self, client, chat_id, id, text="", document=None):
+        self.client = client
+        self.chat = SimpleNamespace(id=chat_id)
+        self.id = id
+        self.text = text
+        self.document = document
+
+    async def reply_text(self, text, *args, **kwargs):
+        return await self.client.send_message(self.chat.id, text)
+
+    reply = reply_text
+
+    async def edit_text(self, text, *args, **kwargs):
+        await self.client._call("edit", None)
+        self.text = text
+
+    async def pin(self, *args, **kwargs):
+        await self.client._call("other", None)
+
+    async def delete(self, *args, **kwargs):
+        await self.client._call("other", None)
+
+
+class FakeSession:
+    """the media session of a FakeClient, every part counts as an upload call"""
+
+    def __init__(self, client):
+        self.client = client
+
+    async def invoke(self, query, *args, **kwargs):
+        # paced by the caller like a real Session, only the network is simulated
+        return await self.client._request("upload", len(query.bytes), lambda: True)
+
+    async def stop(self):
+        pass
+
+
+class FakeClient:
+    """
+    an in-memory stand-in for the pyrogram Client methods ChannelCopier uses
+
+    every call waits `latency` seconds, transfers take their size divided by
+    `bandwidth` on top, and a call of the classes in `flood_classes` raises a
+    FloodWait of `flood_seconds` with probability `flood_rate`. the calls go
+    through a RateLimiter like the ones of LimitedClient.
+    the media are built from raw objects by pyrogram itself, so the messages
+    a messages.Search returns carry the same file ids as the others.
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        bandwidth=None,
+        flood_rate=0.0,
+        flood_seconds=1,
+        flood_classes=("send", "forward"),
+        seed=0,
+        limiter=None,
+    ):
+        self.name = "fake"
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.flood_rate = flood_rate
+        self.flood_seconds = flood_seconds
+        self.flood_classes = flood_classes
+        self.random = random.Random(seed)
+        self.limiter = limiter or RateLimiter(sleep_threshold=60, min_interval=0)
+        self.parser = FakeParser()
+        self.is_connected = True
+        self.message_cache = Cache(10000)
+
+        self.calls = {}
+        self.chats = {}  # chat id -> chat namespace with a "messages" dict
+        self.links = {}
+        self.files = {}  # file id -> size
+        self.documents = {}  # file id -> local path served by download_media
+        self.next_ids = {"chat": -1000000000000, "file": 0, "random": 0}
+
+    # the simulated network
+
+    async def _call(self, method_class, size, func=None, *args):
+        return await self.limiter.call(
+            method_class, self._request, method_class, size, func, *args
+        )
+
+    async def _request(self, method_class, size, func, *args):
+        self.calls[method_class] = self.calls.get(method_class, 0) + 1
+        if (
+            method_class in self.flood_classes
+            and self.random.random() < self.flood_rate
+        ):
+            raise FloodWait(value=self.flood_seconds)
+
+        delay = self.latency
+        if size and self.bandwidth:
+            delay += size / self.bandwidth
+        if delay:
+            await asyncio.sleep(delay)
+        if func is not None:
+            return func(*args)
+
+    # building the fake world
+
+    def add_chat(self, title, protected=True, link=None):
+        self.next_ids["chat"] -= 1
+        chat = SimpleNamespace(
+            id=self.next_ids["chat"],
+            title=title,
+            has_protected_content=protected,
+            invite_link=f"https://t.me/+fake{-self.next_ids['chat']}",
+            messages={},
+            raw_messages={},  # what messages.Search returns
+            next_message_id=1,
+        )
+        self.chats[chat.id] = chat
+        if link:
+            self.links[link] = chat
+        return chat
+
+    def _file(self, size):
+        self.next_ids["file"] += 1
+        file_id = f"file{self.next_ids['file']}"
+        self.files[file_id] = size
+        return file_id, f"unique{self.next_ids['file']}"
+
+    def add_message(self, chat, kind, size=0, caption=None, media_group_id=None):
+        # kind is text, photo or video
+        message_id = chat.next_message_id
+        chat.next_message_id += 1
+        self.next_ids["file"] += 1
+        media_id = self.next_ids["file"]
+        media, raw_media = {}, None
+        if kind == "photo":
+            photo = raw.types.Photo(
+                id=media_id,
+                access_hash=0,
+                file_reference=b"",
+                date=0,
+                sizes=[raw.types.PhotoSize(type="y", w=1280, h=720, size=size)],
+                dc_id=1,
+            )
+            raw_media = raw.types.MessageMediaPhoto(photo=photo)
+            media["photo"] = types.Photo._parse(self, photo)
+            self.files[media["photo"].file_id] = size
+        elif kind == "video":
+            attributes = raw.types.DocumentAttributeVideo(duration=60, w=1280, h=720)
+            document = raw.types.Document(
+                id=media_id,
+                access_hash=0,
+                file_reference=b"",
+                date=0,
+                mime_type="video/mp4",
+                size=size,
+                dc_id=1,
+                attributes=[attributes],
+                thumbs=[raw.types.PhotoSize(type="m", w=320, h=180, size=20 * 1024)],
+            )
+            raw_media = raw.types.MessageMediaDocument(document=document)
+            video = media["video"] = types.Video._parse(
+                self, document, attributes, f"video{media_id}.mp4"
+            )
+            self.files[video.file_id] = size
+            self.files[video.thumbs[0].file_id] = 20 * 1024
+
+        message = types.Message(
+            id=message_id,
+            text=caption if kind == "text" else None,
+            caption=None if kind == "text" else caption,
+            media_group_id=media_group_id,
+            **media,
+        )
+        chat.messages[message_id] = message
+        chat.raw_messages[message_id] = raw.types.Message(
+            id=message_id,
+            peer_id=raw.types.PeerChannel(channel_id=self._channel_id(chat)),
+            date=0,
+            message=caption or "",
+            entities=[],
+            media=raw_media,
+            grouped_id=int(media_group_id) if media_group_id else None,
+        )
+        return message
+
+    def add_document(self, path):
+        file_id, unique_id = self._file(os.path.getsize(path))
+        self.documents[file_id] = path
+        return SimpleNamespace(
+            file_id=file_id,
+            file_unique_id=unique_id,
+            file_name=os.path.basename(path),
+            file_size=os.path.getsize(path),
+        )
+
+    def _chat(self, chat_id):
+        if isinstance(chat_id, str):
+            return self.links.get(chat_id) or self.chats[int(chat_id)]
+        return self.chats[chat_id]
+
+    def _channel_id(self, chat):
+        return -chat.id - 1000000000000
+
+    def _raw_channel(self, chat):
+        return raw.types.Channel(
+            id=self._channel_id(chat),
+            title=chat.title,
+            photo=raw.types.ChatPhotoEmpty(),
+            date=0,
+            access_hash=0,
+            usernames=[],
+            restriction_reason=[],
+        )
+
+    def _search(self, query):
+        # newest first like telegram, add_offset counts from offset_id on
+        chat = self.chats[-query.peer.channel_id - 1000000000000]
+        kinds = SEARCH_FILTERS.get(type(query.filter))
+        ids = [
+            i
+            for i in sorted(chat.messages, reverse=True)
+            if i > query.min_id
+            and (not query.max_id or i < query.max_id)
+            and (kinds is None or self._kind(chat.messages[i]) in kinds)
+        ]
+        count = len(ids)
+        if query.offset_id:
+            ids = [i for i in ids if i < query.offset_id]
+        start = max(query.add_offset, 0)
+        ids = ids[start : start + query.limit]
+        return raw.types.messages.ChannelMessages(
+            pts=0,
+            count=count,
+            messages=[chat.raw_messages[i] for i in ids],
+            topics=[],
+            chats=[self._raw_channel(chat)],
+            users=[],
+        )
+
+    @staticmethod
+    def _kind(message):
+        if message.video:
+            return "video"
+        if message.photo:
+            return "photo"
+
+    def _deliver(self, chat_id, count=1):
+        # the master chat and "me" are not simulated, only the calls count
+        chat = self.chats.get(chat_id) or self.links.get(chat_id)
+        if chat is not None:
+            chat.next_message_id += count
+
+    # the client methods
+
+    async def media_session(self):
+        return FakeSession(self)
+
+    def rnd_id(self):
+        self.next_ids["random"] += 1
+        return self.next_ids["random"]
+
+    def guess_mime_type(self, filename):
+        return "video/mp4" if filename.endswith(".mp4") else None
+
+    async def get_chat(self, chat_id):
+        return await self._call("other", None, self._chat, chat_id)
+
+    async def join_chat(self, link):
+        await self._call("other", None)
+
+    async def leave_chat(self, chat_id):
+        await self._call("other", None)
+
+    async def create_channel(self, title):
+        await self._call("other", None)
+        return self.add_chat(title, protected=False)
+
+    async def resolve_peer(self, chat_id):
+        chat = self._chat(chat_id)
+        return raw.types.InputPeerChannel(
+            channel_id=self._channel_id(chat), access_hash=0
+        )
+
+    async def get_messages(self, chat_id, message_ids):
+        chat = self._chat(chat_id)
+
+        def lookup(message_id):
+            return chat.messages.get(message_id) or types.Message(
+                id=message_id, empty=True
+            )
+
+        if isinstance(message_ids, int):
+            return await self._call("get_history", None, lookup, message_ids)
+        return await self._call(
+            "get_history", None, lambda: [lookup(i) for i in message_ids]
+        )
+
+    async def get_chat_history(self, chat_id, min_id=0, **kwargs):
+        chat = self._chat(chat_id)
+        ids = sorted((i for i in chat.messages if i > min_id), reverse=True)
+        for start in range(0, len(ids), 100):
+            await self._call("get_history", None)
+            for message_id in ids[start : start + 100]:
+                yield chat.messages[message_id]
+
+    async def search_messages_count(
+        self, chat_id, filter=enums.MessagesFilter.EMPTY, **kwargs
+    ):
+        r = await self.invoke(
+            raw.functions.messages.Search(
+                peer=await self.resolve_peer(chat_id),
+                q="",
+                filter=filter.value(),
+                min_date=0,
+                max_date=0,
+                offset_id=0,
+                add_offset=0,
+                limit=1,
+                max_id=0,
+                min_id=0,
+                hash=0,
+            )
+        )
+        return r.count
+
+    async def send_message(self, chat_id, text, *args, **kwargs):
+        await self._call("send", None)
+        self._deliver(chat_id)
+        return FakeMessage(self, chat_id, self.rnd_id(), text)
+
+    async def send_document(self, chat_id, document, *args, **kwargs):
+        await self._call("send", None)
+        self._deliver(chat_id)
+
+    send_audio = send_document
+
+    async def forward_messages(self, chat_id, from_chat_id, message_ids, **kwargs):
+        await self._call("forward", None)
+        self._deliver(chat_id, len(message_ids))
+
+    async def download_media(self, file_id, file_name=None, in_memory=False, **kw):
+        if file_id in self.documents:
+            size = os.path.getsize(self.documents[file_id])
+            await self._call("download", size)
+            path = os.path.join(
+                file_name or ".", os.path.basename(self.documents[file_id])
+            )
+            shutil.copy(self.documents[file_id], path)
+            return path
+
+        size = self.files[file_id]
+        await self._call("download", size)
+        # the file comes as chunks of 1 MiB, each one a round trip
+        await asyncio.sleep(self.latency * max(math.ceil(size / CHUNK_SIZE) - 1, 0))
+        if in_memory:
+            file = io.BytesIO(bytes(size))
+            file.name = file_id
+            return file
+
+        # a sparse file, the benchmark measures the copier and not the disk
+        path = os.path.join(file_name, file_id)
+        with open(path, "wb") as f:
+            f.truncate(size)
+        return path
+
+    async def stream_media(self, file_id, limit=0, offset=0):
+        # one call per chunk of 1 MiB, like the GetFile requests behind it
+        size = self.files[file_id]
+        end = math.ceil(size / CHUNK_SIZE)
+        if limit:
+            end = min(end, offset + limit)
+        for index in range(offset, end):
+            length = min(CHUNK_SIZE, size - index * CHUNK_SIZE)
+            await self._call("download", length)
+            yield bytes(length)
+
+    async def save_file(self, path, *args, **kwargs):
+        if isinstance(path, io.BytesIO):
+            size, name = len(path.getbuffer()), path.name
+        else:
+            size, name = os.path.getsize(path), os.path.basename(path)
+        await self._call("upload", size)
+        self.next_ids["file"] += 1
+        return raw.types.InputFile(
+            id=self.next_ids["file"], parts=1, name=name, md5_checksum=""
+        )
+
+    async def invoke(self, query, *args, **kwargs):
+        method_class = METHOD_CLASSES.get(type(query), "other")
+        peer = getattr(query, "peer", None)
+        await self._call(method_class, None)
+        if isinstance(query, raw.functions.messages.Search):
+            return self._search(query)
+        if isinstance(query, raw.functions.messages.UploadMedia):
+            return self._stored_media()
+        if isinstance(query, raw.functions.messages.SendMultiMedia):
+            self._deliver(-peer.channel_id - 1000000000000, len(query.multi_media))
+            return raw.types.Updates(updates=[], users=[], chats=[], date=0, seq=0)
+        if isinstance(query, raw.functions.messages.SendMedia):
+            self._deliver(-peer.channel_id - 1000000000000)
+            return SimpleNamespace(
+                updates=[
+                    SimpleNamespace(message=SimpleNamespace(media=self._stored_media()))
+                ]
+            )
+
+    def _stored_media(self):
+        self.next_ids["file"] += 1
+        return raw.types.MessageMediaDocument(
+            document=raw.types.Document(
+                id=self.next_ids["file"],
+                access_hash=0,
+                file_reference=b"",
+                date=0,
+                mime_type="video/mp4",
+                size=0,
+                dc_id=1,
+                attributes=[],
+            )
+        )
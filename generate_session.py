@@ -22,7 +22,11 @@ async def main():
         )
         return
 
-    async with Client("my_userbot", api_id=API_ID, api_hash=API_HASH) as app:
+    # helper accounts are numbered SESSION_STRING_1, SESSION_STRING_2...
+    number = input("Helper number, leave empty for the main account: ")
+    name = f"helper_{number}" if number else "my_userbot"
+
+    async with Client(name, api_id=API_ID, api_hash=API_HASH) as app:
         print("\n\nYour session string:")
         sess_str = await app.export_session_string()
         print(sess_str)
@@ -30,8 +34,9 @@ async def main():
 
         to_write = input("Write it to /.env file? [y/N]: ")
         if to_write == "y":
+            key = f"SESSION_STRING_{number}" if number else "SESSION_STRING"
             with open("./.env", "a") as f:
-                f.write(f"\nSESSION_STRING={sess_str}\n")
+                f.write(f"\n{key}={sess_str}\n")
 
 
 if __name__ == "__main__":
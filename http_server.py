@@ -0,0 +1,75 @@
+import asyncio
+
+STATUS_TEXT = {
+    200: "OK",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    500: "Internal Server Error",
+}
+
+
+class HttpServer:
+    """
+    a minimal HTTP/1.1 server running on the bot's own event loop
+
+    `routes` maps a path to a function returning (content type, body), only
+    GET is served and every connection is closed after its response.
+    """
+
+    def __init__(self, routes):
+        self.routes = routes
+        self.server = None
+
+    async def start(self, host, port):
+        self.server = await asyncio.start_server(self._handle, host, port)
+        print(f"http server listening on {host}:{port}")
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def _read_request(self, reader):
+        request_line = await reader.readline()
+        while True:  # the headers are not needed
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+        method, target, _ = request_line.decode("latin-1").split(" ", 2)
+        return method, target.split("?", 1)[0]
+
+    async def _handle(self, reader, writer):
+        try:
+            method, path = await asyncio.wait_for(self._read_request(reader), 10)
+        except (ValueError, asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+
+        route = self.routes.get(path)
+        content_type, body = "text/plain", ""
+        if method != "GET":
+            status = 405
+        elif route is None:
+            status = 404
+        else:
+            try:
+                content_type, body = route()
+                status = 200
+            except Exception as e:
+                print(f"http route {path} failed: {e}")
+                status = 500
+
+        data = body.encode()
+        head = (
+            f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            "Connection: close\r\n\r\n"
+        )
+        try:
+            writer.write(head.encode() + data)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,95 @@
+import json
+import os
+import time
+import uuid
+
+
+class Job:
+    """
+    one copy job, persisted as an append-only JSON Lines file
+
+    the first line holds the job kind, the following lines update the params,
+    record the planned source ids and the source ids already copied.
+    a torn last line (crash while writing) is ignored on load.
+    """
+
+    def __init__(self, path, kind, params):
+        self.path = path
+        self.id = os.path.basename(path).removesuffix(".jsonl")
+        self.kind = kind
+        self.params = params
+        self.plan = None
+        self.done = set()
+
+    @classmethod
+    def load(cls, path):
+        job = None
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+
+                if job is None:
+                    job = cls(path, record["kind"], record["params"])
+                elif "params" in record:
+                    job.params.update(record["params"])
+                elif "plan" in record:
+                    job.plan = record["plan"]
+                elif "done" in record:
+                    job.done.update(record["done"])
+
+        return job
+
+    def _write(self, record):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def update(self, **params):
+        self.params.update(params)
+        self._write({"params": params})
+
+    def set_plan(self, ids):
+        self.plan = list(ids)
+        self._write({"plan": self.plan})
+
+    def remaining(self):
+        return [i for i in self.plan if i not in self.done]
+
+    def mark_done(self, *ids):
+        if not ids:
+            return
+        self.done.update(ids)
+        self._write({"done": ids})
+
+    def finish(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class JobJournal:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def create(self, kind, params):
+        # time prefix so the jobs are listed (and resumed) in creation order
+        name = f"{int(time.time())}-{uuid.uuid4().hex[:6]}.jsonl"
+        path = os.path.join(self.directory, name)
+        job = Job(path, kind, params)
+        job._write({"kind": kind, "params": params})
+        return job
+
+    def unfinished(self):
+        jobs = []
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith(".jsonl"):
+                continue
+            job = Job.load(os.path.join(self.directory, name))
+            if job is not None:
+                jobs.append(job)
+
+        return jobs
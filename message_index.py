@@ -0,0 +1,83 @@
+import sqlite3
+
+
+class MessageIndex:
+    """media messages of the source channels, so rescans only fetch new messages"""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS channels (
+                chat_id INTEGER PRIMARY KEY,
+                max_id INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS media (
+                chat_id INTEGER NOT NULL,
+                id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                file_unique_id TEXT,
+                size INTEGER,
+                duration INTEGER,
+                PRIMARY KEY (chat_id, id)
+            );
+            """
+        )
+
+    def max_id(self, chat_id):
+        row = self.db.execute(
+            "SELECT max_id FROM channels WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def add(self, chat_id, messages):
+        rows = []
+        for message in messages:
+            media = message.video or message.photo
+            if not media:
+                continue
+            rows.append(
+                (
+                    chat_id,
+                    message.id,
+                    "video" if message.video else "photo",
+                    media.file_unique_id,
+                    media.file_size,
+                    message.video.duration if message.video else None,
+                )
+            )
+
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO media VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def set_max_id(self, chat_id, max_id):
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO channels VALUES (?, ?)", (chat_id, max_id)
+            )
+
+    def count(self, chat_id, kinds):
+        return self.db.execute(
+            f"SELECT COUNT(*) FROM media WHERE chat_id = ? AND kind IN ({_marks(kinds)})",
+            (chat_id, *kinds),
+        ).fetchone()[0]
+
+    def ids(self, chat_id, kinds, offset=0, limit=-1):
+        # oldest first, offset/limit are positions among the media of `kinds`
+        rows = self.db.execute(
+            f"""
+            SELECT id FROM media WHERE chat_id = ? AND kind IN ({_marks(kinds)})
+            ORDER BY id LIMIT ? OFFSET ?
+            """,
+            (chat_id, *kinds, limit, offset),
+        )
+        return [row[0] for row in rows]
+
+    def close(self):
+        self.db.close()
+
+
+def _marks(kinds):
+    return ", ".join("?" for _ in kinds)
@@ -0,0 +1,134 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# a minimal registry rendered in the prometheus text format, the lock keeps
+# a render consistent when it runs in another thread than the updates
+_lock = threading.Lock()
+_metrics = []
+
+DEFAULT_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self.values = {}
+        _metrics.append(self)
+
+    def inc(self, *labels, amount=1):
+        with _lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for labels, value in self.values.items():
+            lines.append(f"{self.name}{_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Gauge:
+    """a value read when the metrics are rendered"""
+
+    def __init__(self, name, documentation, read=None):
+        self.name = name
+        self.documentation = documentation
+        self.read = read
+        _metrics.append(self)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+        ]
+        if self.read is not None:
+            lines.append(f"{self.name} {self.read()}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = labels
+        self.buckets = buckets
+        self.values = {}  # labels -> [bucket counts, sum, count]
+        _metrics.append(self)
+
+    def observe(self, value, *labels):
+        with _lock:
+            if labels not in self.values:
+                self.values[labels] = [[0] * len(self.buckets), 0, 0]
+            counts, _, _ = entry = self.values[labels]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - started, *labels)
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        names = (*self.label_names, "le")
+        for labels, (counts, total, count) in self.values.items():
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(
+                    f"{self.name}_bucket{_labels(names, (*labels, bound))} {bucket_count}"
+                )
+            lines.append(
+                f"{self.name}_bucket{_labels(names, (*labels, '+Inf'))} {count}"
+            )
+            label_text = _labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{label_text} {total}")
+            lines.append(f"{self.name}_count{label_text} {count}")
+        return lines
+
+
+def render():
+    with _lock:
+        lines = []
+        for metric in _metrics:
+            lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+bytes_downloaded = Counter("pccs_downloaded_bytes_total", "Bytes of media downloaded")
+bytes_uploaded = Counter("pccs_uploaded_bytes_total", "Bytes of media uploaded")
+items = Counter(
+    "pccs_items_total", "Media items handled, by result", labels=("result",)
+)
+stage_seconds = Histogram(
+    "pccs_stage_seconds",
+    "Latency of the transfer stages",
+    labels=("stage",),
+)
+flood_waits = Counter(
+    "pccs_flood_waits_total", "FloodWaits received, by method class", labels=("method",)
+)
+flood_seconds = Counter(
+    "pccs_flood_wait_seconds_total",
+    "Seconds paused by FloodWaits, by method class",
+    labels=("method",),
+)
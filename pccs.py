@@ -1,16 +1,17 @@
 import asyncio
+import io
+import itertools
+import json
 import os
 import pickle
 import random
 import re
 import signal
 from datetime import datetime, timedelta, timezone
-from threading import Thread
 
 import dotenv
 from _pickle import UnpicklingError
-from flask import Flask
-from pyrogram import Client, enums, filters, types
+from pyrogram import Client, enums, filters, raw, types, utils
 from pyrogram.errors import (
     ChannelInvalid,
     ChatAdminRequired,
@@ -21,7 +22,24 @@ from pyrogram.errors import (
 )
 from pyrogram.handlers import MessageHandler
 from pyrogram.types import ChatPreview, Message
-from tqdm import tqdm
+
+import export_format
+import metrics
+from concurrency import ConcurrencyController
+from downloads import RangedDownloader
+from http_server import HttpServer
+from journal import JobJournal
+from message_index import MessageIndex
+from pipeline import TransferPipeline
+from progress import ProgressReporter
+from rate_limiter import LimitedClient, RateLimiter
+from scheduler import JobScheduler
+from scratch import ScratchSpace
+from session_pool import SessionPool
+from thumbnails import ThumbnailCache
+from tracing import Tracer, current_task
+from upload_cache import UploadCache, input_media, sent_media
+from uploads import FileUploader, PartUploader
 
 is_prod = os.getenv("PRODUCTION")
 
@@ -33,43 +51,129 @@ API_ID = os.getenv("API_ID")
 API_HASH = os.getenv("API_HASH")
 MASTER_CHAT_USERNAME = os.getenv("MASTER_CHAT_USERNAME")
 SESSION_STRING = os.getenv("SESSION_STRING")
-
-if not MASTER_CHAT_USERNAME == "me" or MASTER_CHAT_USERNAME == "self":
+# helper accounts the downloads are spread over, SESSION_STRING_1, _2, ...
+HELPER_SESSION_STRINGS = []
+while os.getenv(f"SESSION_STRING_{len(HELPER_SESSION_STRINGS) + 1}"):
+    HELPER_SESSION_STRINGS.append(
+        os.getenv(f"SESSION_STRING_{len(HELPER_SESSION_STRINGS) + 1}")
+    )
+HTTP_PORT = int(os.getenv("HTTP_PORT", 8000))
+# jobs running at the same time, the others wait in a queue
+MAX_JOBS = int(os.getenv("MAX_JOBS", 2))
+# the downloads running at first, raised up to MAX_DOWNLOAD_WORKERS while the
+# throughput improves and cut in half by every FloodWait
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", 2))
+MAX_DOWNLOAD_WORKERS = max(int(os.getenv("MAX_DOWNLOAD_WORKERS", 6)), DOWNLOAD_WORKERS)
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", 1))
+PIPELINE_BUFFER = int(os.getenv("PIPELINE_BUFFER", 4))
+# files from this size on are fetched as byte ranges on several connections
+RANGED_DOWNLOAD_SIZE = int(os.getenv("RANGED_DOWNLOAD_SIZE", 32 * 1024 * 1024))
+RANGED_DOWNLOAD_WORKERS = int(os.getenv("RANGED_DOWNLOAD_WORKERS", 4))
+# files from this size on are uploaded by FileUploader, 0 leaves every file to save_file
+PARALLEL_UPLOAD_SIZE = int(os.getenv("PARALLEL_UPLOAD_SIZE", 10 * 1024 * 1024))
+# the parts of one file sent at the same time
+UPLOAD_PART_WORKERS = int(os.getenv("UPLOAD_PART_WORKERS", 8))
+# "search" uses telegram's media filters, "history" walks the whole chat
+SCAN_MODE = os.getenv("SCAN_MODE", "search")
+# set to an empty string to scan the source channel on every job instead
+INDEX_PATH = os.getenv("INDEX_PATH", "pccs_index.sqlite3")
+JOURNAL_DIR = os.getenv("JOURNAL_DIR", "jobs")
+# upper bound of the ids forwarded per call, telegram accepts up to 100
+FORWARD_CHUNK = min(int(os.getenv("FORWARD_CHUNK", 100)), 100)
+# minimum seconds between two edits of a progress bar
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", 5))
+# media up to this many bytes never touches the disk, bigger files are
+# downloaded to the disk first, 0 disables the in-memory path
+STREAM_MEMORY_CAP = int(os.getenv("STREAM_MEMORY_CAP", 64 * 1024 * 1024))
+# where the bigger media are downloaded, and how many bytes they may take
+SCRATCH_DIR = os.getenv("SCRATCH_DIR", "downloads")
+SCRATCH_QUOTA = int(os.getenv("SCRATCH_QUOTA", 4 * 1024 * 1024 * 1024))
+# telegram accepts up to 10 media in an album
+ALBUM_SIZE = 10
+# bytes of recently downloaded thumbnails kept in memory
+THUMB_CACHE_SIZE = int(os.getenv("THUMB_CACHE_SIZE", 16 * 1024 * 1024))
+# media already uploaded are sent again from here, an empty string disables it
+UPLOAD_CACHE_PATH = os.getenv("UPLOAD_CACHE_PATH", "pccs_uploads.sqlite3")
+# the JSON Lines file the timing spans are written to, empty to keep them in memory only
+TRACE_PATH = os.getenv("TRACE_PATH", "pccs_trace.jsonl")
+# the trace file is rotated at this size, 3 old files are kept
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", 10 * 1024 * 1024))
+
+if MASTER_CHAT_USERNAME and MASTER_CHAT_USERNAME not in ("me", "self"):
     MASTER_CHAT_USERNAME = "@" + MASTER_CHAT_USERNAME
 
 
-server = Flask(__name__)
-
-
-@server.route("/", methods=["GET"])
-def greet():
-    print("Request")
-    return "Hey there"
-
-
-def flask_thread():
-    server.run("0.0.0.0", port=8000)
-    print("Server runs succefully")
-
-
-thread = Thread(target=flask_thread)
-thread.start()
-
-
 class ChannelCopier:
     def __init__(self):
-        self.app = Client(
+        self.tracer = Tracer(TRACE_PATH, TRACE_MAX_BYTES)
+        self.limiter = RateLimiter(sleep_threshold=60, tracer=self.tracer)
+        self.app = LimitedClient(
             "my_userbot",
+            limiter=self.limiter,
             api_id=API_ID,
             api_hash=API_HASH,
             session_string=SESSION_STRING or None,
             in_memory=bool(SESSION_STRING),  # Important for mobile devices
             sleep_threshold=60,
+            max_concurrent_transmissions=MAX_DOWNLOAD_WORKERS + UPLOAD_WORKERS,
+        )
+        self.sessions = SessionPool(
+            self.app,
+            [
+                LimitedClient(
+                    f"helper_{n}",
+                    limiter=RateLimiter(sleep_threshold=60, tracer=self.tracer),
+                    api_id=API_ID,
+                    api_hash=API_HASH,
+                    session_string=session_string,
+                    in_memory=True,
+                    sleep_threshold=60,
+                    max_concurrent_transmissions=MAX_DOWNLOAD_WORKERS,
+                )
+                for n, session_string in enumerate(HELPER_SESSION_STRINGS, 1)
+            ],
+        )
+        # shared by the jobs, a FloodWait on any account slows them all down
+        self.concurrency = ConcurrencyController(
+            DOWNLOAD_WORKERS, maximum=MAX_DOWNLOAD_WORKERS
+        )
+        for client in (self.app, *self.sessions.helpers):
+            client.limiter.flood_listeners.append(self.concurrency.flood)
+        metrics.Gauge(
+            "pccs_transfer_concurrency",
+            "Downloads allowed to run at the same time",
+            lambda: self.concurrency.limit,
         )
         self.tasks_count = 0
         self.state = {}
+        self.scheduler = JobScheduler(MAX_JOBS)
+        metrics.Gauge(
+            "pccs_jobs_running", "Jobs running", lambda: len(self.scheduler.running)
+        )
+        metrics.Gauge(
+            "pccs_jobs_queued",
+            "Jobs waiting for a slot",
+            lambda: len(self.scheduler.queue),
+        )
         self.tz = timezone(timedelta(hours=2))
         self.advertising = False
+        self.index = MessageIndex(INDEX_PATH) if INDEX_PATH else None
+        self.journal = JobJournal(JOURNAL_DIR)
+        self.scratch = ScratchSpace(SCRATCH_DIR, SCRATCH_QUOTA)
+        self.thumbs = ThumbnailCache(THUMB_CACHE_SIZE)
+        self.uploads = UploadCache(UPLOAD_CACHE_PATH) if UPLOAD_CACHE_PATH else None
+        self.stopping = False
+        self.http = HttpServer(
+            {
+                "/": lambda: ("text/plain", "Hey there"),
+                "/health": lambda: ("text/plain", "ok"),
+                "/metrics": lambda: (
+                    "text/plain; version=0.0.4",
+                    metrics.render(),
+                ),
+                "/jobs": lambda: ("application/json", json.dumps(self.jobs_view())),
+            }
+        )
 
         self.shutdown_event = asyncio.Event()
         # handle_sigterm = lambda _, __: asyncio.get_event_loop().call_soon_threadsafe(
@@ -100,6 +204,20 @@ class ChannelCopier:
 
     async def start(self):
         print("program started")
+        self.scratch.sweep()
+        try:
+            await self.http.start("0.0.0.0", HTTP_PORT)
+        except OSError as e:
+            # the port may be taken, the copier works without the http server
+            print(f"http server not started on port {HTTP_PORT}: {e}")
+        # registered first so no command sent right after the greeting is missed
+        self.app.add_handler(
+            MessageHandler(
+                self.parse_command,
+                filters.chat(MASTER_CHAT_USERNAME) & (filters.text | filters.document),
+            ),
+            group=1,
+        )
         try:
             await self.app.start()
             print("Bot is running. Press Ctrl+C to stop.")
@@ -114,19 +232,16 @@ class ChannelCopier:
             await self.app.send_message(
                 MASTER_CHAT_USERNAME, "Listening for commands here"
             )
+            print("Listening for commands here")
 
         except ConnectionError as e:
             print("ConnectionError:", e)
         except (FloodWait, FloodPremiumWait) as e:
             await self.app.send_message("me", str(e))
 
-        self.app.add_handler(
-            MessageHandler(
-                self.parse_command,
-                filters.chat(MASTER_CHAT_USERNAME) & (filters.text | filters.document),
-            ),
-            group=1,
-        )
+        # the helpers are not needed to greet the master, jobs wait for them
+        await self.sessions.start()
+        await self.resume_jobs()
 
         # Keep running
         await self.idle()
@@ -134,22 +249,24 @@ class ChannelCopier:
     async def parse_command(self, client: Client, message: Message):
         print("A message came from the master!")
 
-        if message.document and "pickled" in message.document.file_name:
-            task_id = str(self.tasks_count + 1)
-
-            task = asyncio.create_task(self.file_to_channel(message))
-            task.add_done_callback(
-                lambda _: task_id in self.state and self.state.pop(task_id)
+        if message.document and (
+            "pickled" in message.document.file_name
+            or message.document.file_name.endswith(export_format.SUFFIX)
+        ):
+            job = self.journal.create(
+                "file_to_channel",
+                {
+                    "chat_id": message.chat.id,
+                    "message_id": message.id,
+                    "file_name": message.document.file_name,
+                },
+            )
+            self.register_task(
+                self.file_to_channel(message, job=job),
+                "file_to_channel",
+                message.document.file_name,
+                job=job,
             )
-
-            self.tasks_count += 1
-            self.state[task_id] = {
-                "type": "file_to_channel",
-                "target": message.document.file_name,
-                "started": datetime.now(self.tz),
-                "task": task,
-            }
-
             return
 
         elif not message.text:
@@ -165,13 +282,19 @@ class ChannelCopier:
             target = command[3:]
             if "|" in command:
                 params = target.split("|")
-                if not len(params) == 4:
+                if len(params) == 4:
+                    params.append("forward")
+                if not len(params) == 5 or params[4] not in ("forward", "copy"):
                     await message.reply(
-                        "the sc command must be in the form `***sc src_link|start, end|dest_link|safe` or `***sc src_link`"
+                        "the sc command must be in the form `***sc src_link|start, end|dest_link[, dest_link...]|safe[|forward or copy]` or `***sc src_link`"
                     )
                     return
 
-                src_chann, segment, dest_chann, safe = params
+                src_chann, segment, dest_links, safe, mode = params
+                # several destinations are separated by commas
+                dest_links = [
+                    link.strip() for link in dest_links.split(",") if link.strip()
+                ]
 
                 segment = segment.split(",")
                 try:
@@ -183,53 +306,43 @@ class ChannelCopier:
                     return
                 if len(segment) == 1:
                     segment.append(None)
-
-                task_id = str(self.tasks_count + 1)
-                task = asyncio.create_task(
-                    self.copy_content(message, src_chann, segment, dest_chann, safe)
-                )
-                task.add_done_callback(
-                    lambda _: task_id in self.state and self.state.pop(task_id)
-                )
-
-                self.tasks_count += 1
-                self.state[task_id] = {
-                    "type": "copy content",
-                    "target": src_chann,
-                    "started": datetime.now(self.tz),
-                    "task": task,
-                }
-
             else:
-                task_id = str(self.tasks_count + 1)
-                task = asyncio.create_task(self.copy_content(message, target))
-                task.add_done_callback(
-                    lambda _: task_id in self.state and self.state.pop(task_id)
+                src_chann, segment, dest_links, safe, mode = (
+                    target,
+                    [None, None],
+                    [],
+                    False,
+                    "forward",
                 )
 
-                self.tasks_count += 1
-                self.state[task_id] = {
-                    "type": "copy content",
-                    "target": target,
-                    "started": datetime.now(self.tz),
-                    "task": task,
-                }
+            # journaled before it is queued, a job still waiting when the bot
+            # stops is resumed as well
+            job = self.journal.create(
+                "copy_content",
+                {
+                    "chat_id": message.chat.id,
+                    "message_id": message.id,
+                    "src_link": src_chann,
+                    "segment": segment,
+                    "dest_links": dest_links,
+                    "safe": safe,
+                    "mode": mode,
+                },
+            )
+            self.register_task(
+                self.copy_content(
+                    message, src_chann, segment, dest_links, safe, mode, job=job
+                ),
+                "copy content",
+                src_chann,
+                job=job,
+            )
 
         elif command[:2] == "ec":
             link = command[3:]
-            task_id = str(self.tasks_count + 1)
-            task = asyncio.create_task(self.channel_to_file(link, message))
-            task.add_done_callback(
-                lambda _: task_id in self.state and self.state.pop(task_id)
-            )
-
-            self.tasks_count += 1
-            self.state[task_id] = {
-                "type": "channel_to_file",
-                "target": link,
-                "started": datetime.now(self.tz),
-                "task": task,
-            }
+            self.register_task(
+                self.channel_to_file(link, message), "channel_to_file", link
+            )
 
         elif command[:5] == "state":
             await self.get_state(message)
@@ -242,6 +355,12 @@ class ChannelCopier:
             task_id = command[4:]
             await self.kill_task(message, task_id)
 
+        elif command[:4] == "prof":
+            await self.profile_task(message, command[4:].strip())
+
+        elif command[:3] == "top":
+            await self.promote_task(message, command[3:])
+
         elif command[:2] == "sr":
             print("send regulary")
             link, text, interval = command[3:].split(sep="|")
@@ -258,14 +377,103 @@ class ChannelCopier:
         else:
             await message.reply("Invalid command", quote=True)
 
+    def register_task(self, coro, task_type, target, priority=1, job=None):
+        task_id = str(self.tasks_count + 1)
+        # the task and everything it starts trace their spans under its id
+        token = current_task.set(task_id)
+        task = asyncio.create_task(self.scheduler.run(task_id, coro, priority))
+        current_task.reset(token)
+        task.add_done_callback(
+            lambda _: task_id in self.state and self.state.pop(task_id)
+        )
+        if job is not None:
+            task.add_done_callback(lambda task: self.end_job(job, task))
+
+        self.tasks_count += 1
+        self.state[task_id] = {
+            "type": task_type,
+            "target": target,
+            "started": datetime.now(self.tz),
+            "task": task,
+        }
+        return task_id
+
+    async def resume_jobs(self):
+        jobs = self.journal.unfinished()
+        if not jobs:
+            return
+
+        summary = "\n".join(
+            f"\t{job.id}: {job.kind} {job.params.get('src_link') or job.params.get('file_name')}, "
+            f"{len(job.done)}/{len(job.plan) if job.plan is not None else '?'} done"
+            for job in jobs
+        )
+        await self.app.send_message(
+            MASTER_CHAT_USERNAME, f"Resuming {len(jobs)} unfinished jobs:\n{summary}"
+        )
+
+        for job in jobs:
+            try:
+                command_message = await self.app.get_messages(
+                    job.params["chat_id"], job.params["message_id"]
+                )
+            except Exception as e:
+                print(f"Failed to resume job {job.id}: {e}")
+                continue
+
+            if job.kind == "copy_content":
+                self.register_task(
+                    self.copy_content(
+                        command_message,
+                        job.params["src_link"],
+                        job.params["segment"],
+                        job.params.get("dest_links", ()),
+                        safe=job.params["safe"],
+                        mode=job.params.get("mode", "forward"),
+                        job=job,
+                    ),
+                    "copy content",
+                    job.params["src_link"],
+                    priority=0,  # they were running before the restart
+                    job=job,
+                )
+            elif job.kind == "file_to_channel":
+                self.register_task(
+                    self.file_to_channel(command_message, job=job),
+                    "file_to_channel",
+                    job.params["file_name"],
+                    priority=0,
+                    job=job,
+                )
+
+    def end_job(self, job, task):
+        # a job that ended or was killed, even while still queued, is dropped,
+        # one the bot stopped or crashed under is resumed on the next start
+        if self.stopping or (not task.cancelled() and task.exception()):
+            return
+        job.finish()
+
+    async def run_job(self, job, coro):
+        # the journal is dropped when the job ends or is killed, but kept when
+        # the bot stops or crashes so the job is resumed on the next start
+        try:
+            await coro
+        except asyncio.CancelledError:
+            if not self.stopping:
+                job.finish()
+            raise
+        job.finish()
+
     @allow_cancellation
     async def copy_content(
         self,
         command_message,
         src_link,
         segment=[None, None],
-        dest_link=None,
+        dest_links=(),
         safe=False,
+        mode="forward",
+        job=None,
     ):
 
         try:
@@ -276,51 +484,96 @@ class ChannelCopier:
             return
 
         print(f"Source channel ID: {src_chann.id}")
+        if self.sessions.helpers:
+            helpers = await self.sessions.join(src_link, src_chann.id)
+            print(f"{len(helpers)} helper sessions can read the source channel")
         await command_message.reply_text(
             f"Task recived, source channel found, starting Copying Process from {segment[0] or 'the begining'} to {segment[1] or 'the end'}..."
         )
-        if dest_link:
-            try:
-                dest_chann = await self.resolve_channel_id(dest_link)
-                msg = await self.app.send_message(dest_chann.id, ".")
-                await msg.delete()
-            except FloodWait:
-                pass
-            except ChatAdminRequired:
-                await command_message.reply_text(
-                    "You must have write permissions in destination channel"
-                )
-                return
+        dest_channs = []
+        if job is not None and job.params.get("dest_ids"):
+            for dest_id in job.params["dest_ids"]:
+                dest_channs.append(await self.app.get_chat(dest_id))
+        elif job is not None and job.params.get("dest_id"):
+            dest_channs.append(await self.app.get_chat(job.params["dest_id"]))
+        elif dest_links:
+            for dest_link in dest_links:
+                try:
+                    dest_chann = await self.resolve_channel_id(dest_link)
+                    msg = await self.app.send_message(dest_chann.id, ".")
+                    await msg.delete()
+                except FloodWait:
+                    pass
+                except ChatAdminRequired:
+                    await command_message.reply_text(
+                        f"You must have write permissions in destination channel {dest_link}"
+                    )
+                    return
 
-            except Exception as e:
-                print(f"Failed to resolve destination channel\n{e}")
-                await command_message.reply_text(
-                    f"Failed to resolve destination channel\n{e}"
-                )
-                return
+                except Exception as e:
+                    print(f"Failed to resolve destination channel {dest_link}\n{e}")
+                    await command_message.reply_text(
+                        f"Failed to resolve destination channel {dest_link}\n{e}"
+                    )
+                    return
+                dest_channs.append(dest_chann)
 
         else:
             dest_chann_id = await self.create_destination_channel(
                 src_chann.title + " [C]"
             )
 
-            dest_chann = await self.app.get_chat(dest_chann_id)
+            dest_channs.append(await self.app.get_chat(dest_chann_id))
 
-        print(f"Destination channel ID: {dest_chann.id}")
+        dest_ids = [dest_chann.id for dest_chann in dest_channs]
+        invite_links = " ".join(
+            str(dest_chann.invite_link) for dest_chann in dest_channs
+        )
+        print(f"Destination channel IDs: {dest_ids}")
+        if job is None:
+            job = self.journal.create(
+                "copy_content",
+                {
+                    "chat_id": command_message.chat.id,
+                    "message_id": command_message.id,
+                    "src_link": src_link,
+                    "segment": segment,
+                    "dest_links": list(dest_links),
+                    "safe": safe,
+                    "mode": mode,
+                    "dest_ids": dest_ids,
+                },
+            )
+        elif not job.params.get("dest_ids"):
+            # a job journaled when it was queued, its destinations are known now
+            job.update(dest_ids=dest_ids)
 
         await command_message.reply_text(
-            f"Mission Strarted, you can follow up here {dest_chann.invite_link}"
+            f"Mission Strarted, you can follow up here {invite_links}"
         )
 
         bar_message = await command_message.reply_text("Progress Bar")
         await bar_message.pin(both_sides=True)
-        await self.archive_existing_videos(
-            src_chann.id, segment, dest_chann.id, safe, bar_message, src_link=src_link
+        progress = ProgressReporter(bar_message, interval=PROGRESS_INTERVAL)
+        self.attach_progress(progress)
+        await self.run_job(
+            job,
+            self.archive_existing_videos(
+                src_chann.id,
+                segment,
+                dest_ids,
+                safe,
+                progress,
+                job,
+                src_link=src_link,
+                mode=mode,
+            ),
         )
+        await progress.flush()
 
         print("Mission Completed")
         await command_message.reply_text(
-            f"Mission Completed, here you are {dest_chann.invite_link}"
+            f"Mission Completed, here you are {invite_links}" + self.saved_text(job)
         )
 
     async def resolve_channel_id(self, link):
@@ -358,9 +611,55 @@ class ChannelCopier:
             await asyncio.sleep(e.value)
             return await self.create_destination_channel(title)
 
-    async def download_and_upload(self, message_or_id, src_id, dest_id, bar_message):
+    async def flood_wait(self, e, progress, message_id):
+        print(f"Flood wait: {e.value}s")
+        try:
+            wait_period = timedelta(seconds=e.value)
+            now = datetime.now(self.tz)
+            end_time = (now + wait_period).strftime("%H:%M:%S")
+            cause = re.search(r"(\(.+\))", str(e)).group(1)
+            await progress.note(
+                f"FloodWaited for {wait_period.seconds//60}:{wait_period.seconds%60}, until {end_time},  {cause}, last_message_id: {message_id}",
+            )
+
+        except:
+            pass
+        with self.tracer.span("flood_wait", message_id):
+            await asyncio.sleep(e.value)
+
+    async def download_stage(self, message_or_id, src_id, progress, ticket=None):
+        # ticket is the item's place in the scratch space queue, it is given
+        # up on every path that does not reserve disk space
+        client = self.sessions.acquire(src_id)
+        try:
+            with metrics.stage_seconds.time("download"):
+                downloaded = await self.download_with(
+                    client, message_or_id, src_id, progress, ticket
+                )
+        finally:
+            self.sessions.release(client)
+            if ticket is not None:
+                self.scratch.cancel(ticket)
+
+        if downloaded["path"] or downloaded["file"]:
+            message = downloaded["message"]
+            size = (message.video or message.photo).file_size or 0
+            metrics.bytes_downloaded.inc(amount=size)
+            if downloaded["file"]:  # streamed, so uploaded as well
+                metrics.bytes_uploaded.inc(amount=size)
+        return downloaded
+
+    async def download_with(self, client, message_or_id, src_id, progress, ticket=None):
         if isinstance(message_or_id, int):
-            message = await self.app.get_messages(src_id, message_or_id)
+            message = None
+            if client is not self.app:
+                message = await self.helper_copy(client, src_id, message_or_id)
+            if message is None:
+                client = self.app
+                with self.tracer.span("get_messages", message_or_id):
+                    message = await self.app.get_messages(src_id, message_or_id)
+            if message and message.empty:
+                message = None
         elif isinstance(message_or_id, Message):
             message = message_or_id
         else:
@@ -368,79 +667,289 @@ class ChannelCopier:
                 f"message or id must be of type int or pyrogram.types.Message, {type(message_or_id)} was given instead"
             )
 
-        if not message:
-            await self.app.send_message(MASTER_CHAT_USERNAME, "Message not Found")
-            return
+        # "path" is a file path, or a BytesIO for media kept in memory,
+        # "file" is set instead when the video was streamed straight to upload,
+        # "cached" when the media was already uploaded and needs no transfer
+        downloaded = {
+            "message": message,
+            "path": None,
+            "file": None,
+            "thumb_path": None,
+            "scratch": None,
+            "cached": None,
+            "error": None,
+        }
+        if not message or not (message.video or message.photo):
+            return downloaded
+
+        media = message.photo or message.video
+        if self.uploads is not None:
+            downloaded["cached"] = self.uploads.get(media.file_unique_id)
+            if downloaded["cached"]:
+                print(
+                    f"media of id {message.id} was already uploaded, skipping download"
+                )
+                return downloaded
 
-        if not message.video and not message.photo:
-            await self.app.send_message(
-                dest_id,
-                f"message of id {message.id} contain NO media!, how did it reach here?",
+        if client is not self.app and message is message_or_id:
+            # file references belong to the account that read the message
+            copy = await self.helper_copy(client, src_id, message.id)
+            if copy is None:
+                client = self.app
+            else:
+                message = downloaded["message"] = copy
+                media = message.photo or message.video
+
+        thumb = (
+            message.video.thumbs[0] if message.video and message.video.thumbs else None
+        )
+        in_memory = 0 < (media.file_size or 0) <= STREAM_MEMORY_CAP
+        if in_memory and ticket is not None:
+            self.scratch.cancel(ticket)  # later items need not wait for this one
+        # fetched while the video downloads, it is small enough to stay in memory
+        thumb_task = (
+            asyncio.create_task(self.fetch_thumb(client, thumb)) if thumb else None
+        )
+        try:
+            while True:
+                try:
+                    if in_memory and message.video:
+                        try:
+                            with self.tracer.span("stream", message.id):
+                                downloaded["file"] = await self.stream_upload(
+                                    client, message
+                                )
+                        except (FloodWait, FloodPremiumWait, FileReferenceExpired):
+                            raise
+                        except Exception as e:
+                            print(f"streaming {message.id} failed, using the disk: {e}")
+                            in_memory = False
+                            continue
+                    elif in_memory:
+                        with self.tracer.span("download_media", message.id):
+                            downloaded["path"] = await client.download_media(
+                                media.file_id, in_memory=True
+                            )
+                    else:
+                        if downloaded["scratch"] is None:
+                            downloaded["scratch"] = await self.scratch.reserve(
+                                media.file_size or 0, ticket
+                            )
+                        with self.tracer.span("download_media", message.id):
+                            downloaded["path"] = await self.download_file(
+                                client, media, downloaded["scratch"].directory
+                            )
+
+                    if thumb_task and (downloaded["path"] or downloaded["file"]):
+                        downloaded["thumb_path"] = await thumb_task
+                    break
+                except (FloodWait, FloodPremiumWait) as e:
+                    await self.flood_wait(e, progress, message.id)
+                except FileReferenceExpired:
+                    print("expired file")
+                    raise
+                except Exception as e:
+                    downloaded["error"] = e
+                    break
+        except BaseException:
+            # FileReferenceExpired or a cancellation, nothing will commit this item
+            self.discard_downloaded(downloaded)
+            raise
+        finally:
+            if thumb_task and not thumb_task.done():
+                thumb_task.cancel()
+
+        if downloaded["path"] or downloaded["file"]:
+            print(f"media of id {message.id} has been downloaded successfully")
+        return downloaded
+
+    async def download_file(self, client, media, directory):
+        if RANGED_DOWNLOAD_WORKERS < 2 or (media.file_size or 0) < RANGED_DOWNLOAD_SIZE:
+            return await client.download_media(media.file_id, file_name=directory)
+
+        file_name = getattr(media, "file_name", None) or f"{media.file_unique_id}.mp4"
+        downloader = RangedDownloader(
+            client,
+            media.file_id,
+            media.file_size,
+            os.path.join(directory, file_name),
+            workers=RANGED_DOWNLOAD_WORKERS,
+        )
+        try:
+            return await downloader.download()
+        except (FloodWait, FloodPremiumWait, FileReferenceExpired):
+            raise
+        except Exception as e:
+            print(f"ranged download of {file_name} failed, downloading it whole: {e}")
+            return await client.download_media(media.file_id, file_name=directory)
+
+    async def helper_copy(self, client, src_id, message_id):
+        try:
+            with self.tracer.span("get_messages", message_id):
+                message = await client.get_messages(src_id, message_id)
+        except Exception as e:
+            print(f"helper session {client.name} can not read {message_id}: {e}")
+            return None
+        if not message or message.empty or not (message.video or message.photo):
+            return None
+        return message
+
+    async def fetch_thumb(self, client, thumb):
+        # a missing thumbnail is reported when the video is sent, never fatal
+        data = self.thumbs.get(thumb.file_unique_id)
+        if data is None:
+            try:
+                with self.tracer.span("thumb", thumb.file_unique_id):
+                    file = await client.download_media(thumb.file_id, in_memory=True)
+            except Exception as e:
+                print(f"thumbnail {thumb.file_id} could not be downloaded: {e}")
+                return None
+            if not file:
+                return None
+            data = file.getvalue()
+            self.thumbs.put(thumb.file_unique_id, data)
+
+        file = io.BytesIO(data)
+        file.name = f"{thumb.file_unique_id}.jpg"
+        return file
+
+    def discard_downloaded(self, downloaded):
+        if downloaded["scratch"] is not None:
+            downloaded["scratch"].release()
+
+    async def stream_upload(self, client, message):
+        # pipes the download chunks into the upload parts, nothing touches the disk
+        video = message.video
+        file_name = video.file_name or f"{video.file_unique_id}.mp4"
+        async with PartUploader(self.app, video.file_size, file_name) as uploader:
+            async for chunk in client.stream_media(video.file_id):
+                await uploader.write(chunk)
+            return await uploader.finish()
+
+    async def upload_stage(self, downloaded, progress):
+        if downloaded["cached"]:
+            return downloaded["cached"]
+        if not (downloaded["path"] or downloaded["file"]) or downloaded["error"]:
+            return None
+
+        with metrics.stage_seconds.time("upload"):
+            media = await self.upload_media(downloaded, progress)
+        if media is not None and not downloaded["file"]:
+            message = downloaded["message"]
+            metrics.bytes_uploaded.inc(
+                amount=(message.video or message.photo).file_size or 0
             )
-            return
+        return media
+
+    async def upload_media(self, downloaded, progress):
+        message = downloaded["message"]
+        path = downloaded["path"]
 
+        while True:
+            try:
+                if message.photo:
+                    with self.tracer.span("upload", message.id):
+                        file = await self.app.save_file(path)
+                    return raw.types.InputMediaUploadedPhoto(file=file)
+
+                with self.tracer.span("upload", message.id):
+                    thumb = None
+                    if downloaded["thumb_path"]:
+                        thumb = await self.app.save_file(downloaded["thumb_path"])
+                    file = downloaded["file"] or await self.save_file(path)
+                return raw.types.InputMediaUploadedDocument(
+                    mime_type=self.app.guess_mime_type(file.name) or "video/mp4",
+                    file=file,
+                    thumb=thumb,
+                    attributes=[
+                        raw.types.DocumentAttributeVideo(
+                            supports_streaming=True,
+                            duration=message.video.duration,
+                            w=message.video.width,
+                            h=message.video.height,
+                        ),
+                        raw.types.DocumentAttributeFilename(
+                            file_name=os.path.basename(file.name)
+                        ),
+                    ],
+                )
+            except (FloodWait, FloodPremiumWait) as e:
+                await self.flood_wait(e, progress, message.id)
+            except Exception as e:
+                downloaded["error"] = e
+                return None
+
+    async def save_file(self, path):
+        if (
+            not isinstance(path, str)
+            or not PARALLEL_UPLOAD_SIZE
+            or os.path.getsize(path) < PARALLEL_UPLOAD_SIZE
+        ):
+            return await self.app.save_file(path)
+
+        # the parts go through the limiter one by one
+        async with FileUploader(
+            self.app, path, workers=UPLOAD_PART_WORKERS
+        ) as uploader:
+            return await uploader.upload()
+
+    async def commit_stage(self, downloaded, media, dest_ids, progress):
+        # the media is uploaded once, to the first destination, the others
+        # receive it by the server side id of that upload
+        message = downloaded["message"]
         try:
-            if message.photo:
-                photo_path = await self.app.download_media(message.photo.file_id)
-                await self.app.send_photo(dest_id, photo_path, caption=message.caption)
+            if not message:
+                await self.app.send_message(MASTER_CHAT_USERNAME, "Message not Found")
                 return
 
-            video_path = await self.app.download_media(message.video.file_id)
+            if not message.video and not message.photo:
+                await self.notify(
+                    dest_ids,
+                    f"message of id {message.id} contain NO media!, how did it reach here?",
+                )
+                return
 
-            thumb_path = None
-            if video_path:
-                if message.video.thumbs:
-                    thumb_path = await self.app.download_media(
-                        message.video.thumbs[0].file_id
+            if downloaded["cached"]:
+                try:
+                    await self.send_media(
+                        dest_ids[0], downloaded["cached"], message, progress
                     )
-                else:
-                    await self.app.send_message(
-                        dest_id, "the next video contain no thumbnail"
+                    for dest_id in dest_ids[1:]:
+                        await self.send_media(
+                            dest_id, downloaded["cached"], message, progress
+                        )
+                    print(
+                        f"media of id {message.id} has been sent from the upload cache"
                     )
-            else:
-                await self.app.send_message(
-                    dest_id, f"Failed to download video of id {message.id}, skipping..."
+                    return "cached"
+                except Exception as e:
+                    # e.g. the cached upload was deleted, transfer it again
+                    print(f"cached upload of {message.id} is not usable: {e}")
+                    self.uploads.forget((message.video or message.photo).file_unique_id)
+                    downloaded = await self.download_stage(message, None, progress)
+                    media = await self.upload_stage(downloaded, progress)
+
+            if downloaded["error"]:
+                raise downloaded["error"]
+
+            if not media:
+                await self.notify(
+                    dest_ids,
+                    f"Failed to download video of id {message.id}, skipping...",
                 )
                 return "fail"
-                # return await self.download_and_upload(
-                #     message, src_id, dest_id, bar_message
-                # )
-
-            print(f"video of id {message.id} has been downloaded successfully")
-            # Create caption and other metadata
-            caption = message.caption or ""
-            duration = message.video.duration
-
-            # Upload to destination
-            await self.app.send_video(
-                chat_id=dest_id,
-                video=video_path,
-                thumb=thumb_path,
-                caption=caption,
-                supports_streaming=True,
-                duration=duration,
-            )
-
-            print(f"video of id {message.id} has been uploaded successfully")
-        except (FloodWait, FloodPremiumWait) as e:
-            print(f"Flood wait: {e.value}s")
-            try:
-                wait_period = timedelta(seconds=e.value)
-                now = datetime.now(self.tz)
-                end_time = (now + wait_period).strftime("%H:%M:%S")
-                cause = re.search(r"(\(.+\))", str(e)).group(1)
-                current_bar = await self.app.get_messages(
-                    bar_message.chat.id, bar_message.id
-                )
-                await bar_message.edit_text(
-                    current_bar.text
-                    + f"\nFloodWaited for {wait_period.seconds//60}:{wait_period.seconds%60}, until {end_time},  {cause}, last_message_id: {message.id}",
-                )
 
-            except:
-                pass
-            await asyncio.sleep(e.value)
-            return await self.download_and_upload(message, src_id, dest_id, bar_message)
+            if message.video and not downloaded["thumb_path"]:
+                await self.notify(dest_ids, "the next video contain no thumbnail")
+
+            updates = await self.send_media(dest_ids[0], media, message, progress)
+            sent = sent_media(updates)
+            if self.uploads is not None:
+                self.uploads.add((message.video or message.photo).file_unique_id, sent)
+            for dest_id in dest_ids[1:]:
+                await self.send_media(dest_id, sent or media, message, progress)
+
+            print(f"media of id {message.id} has been uploaded successfully")
 
         except FileReferenceExpired:
             print("expired file")
@@ -453,235 +962,526 @@ class ChannelCopier:
                     "me",
                     f"""
                 Error download and uploading: {e}
-                video path is {video_path}
-                download video size is {os.path.getsize(video_path)}
-                telegram video size is {message.video.file_size}
+                video path is {downloaded["path"]}
                 video message id is {message.id}
-                retrying
                 """,
                 )
             except (FloodWait, FloodPremiumWait):
                 pass
 
-            # await asyncio.sleep(3)
-            # return await self.download_and_upload(message, src_id, dest_id, bar_message)
+        finally:
+            self.discard_downloaded(downloaded)
 
-        else:
-            if video_path and os.path.exists(video_path):
-                os.remove(video_path)
-            if thumb_path and os.path.exists(thumb_path):
-                os.remove(thumb_path)
+    async def notify(self, dest_ids, text):
+        for dest_id in dest_ids:
+            await self.app.send_message(dest_id, text)
+
+    async def send_media(self, dest_id, media, message, progress):
+        with metrics.stage_seconds.time("send"):
+            return await self.send_media_once(dest_id, media, message, progress)
+
+    async def send_media_once(self, dest_id, media, message, progress):
+        while True:
+            try:
+                with self.tracer.span("send", message.id):
+                    return await self.app.invoke(
+                        raw.functions.messages.SendMedia(
+                            peer=await self.app.resolve_peer(dest_id),
+                            media=media,
+                            random_id=self.app.rnd_id(),
+                            **await utils.parse_text_entities(
+                                self.app,
+                                message.caption or "",
+                                None,
+                                message.caption_entities,
+                            ),
+                        )
+                    )
+            except (FloodWait, FloodPremiumWait) as e:
+                await self.flood_wait(e, progress, message.id)
+
+    async def commit_album(self, album, dest_ids, progress):
+        # album is a list of (downloaded, media) of one media group, sent with
+        # one call per destination, or item by item if the group is refused.
+        # returns the commit_stage like result of every item
+        if len(album) == 1:
+            return [await self.commit_stage(*album[0], dest_ids, progress)]
+
+        messages = [downloaded["message"] for downloaded, _ in album]
+        sent_to = 0
+        try:
+            medias = []
+            for downloaded, media in album:
+                if not downloaded["cached"]:
+                    media = await self.server_media(
+                        dest_ids[0], media, downloaded["message"], progress
+                    )
+                    if self.uploads is not None:
+                        message = downloaded["message"]
+                        self.uploads.add(
+                            (message.video or message.photo).file_unique_id, media
+                        )
+                medias.append(media)
+
+            for dest_id in dest_ids:
+                await self.send_album(dest_id, medias, messages, progress)
+                sent_to += 1
+            print(f"album of messages {[m.id for m in messages]} has been uploaded")
+            return ["cached" if d["cached"] else None for d, _ in album]
+
+        except Exception as e:
+            print(f"sending the album {messages[0].media_group_id} failed: {e}")
+            return [
+                await self.commit_stage(downloaded, media, dest_ids[sent_to:], progress)
+                for downloaded, media in album
+            ]
+
+        finally:
+            for downloaded, _ in album:
+                self.discard_downloaded(downloaded)
+
+    async def server_media(self, dest_id, media, message, progress):
+        # an uploaded file becomes a photo or document the server knows
+        while True:
+            try:
+                with self.tracer.span("server_media", message.id):
+                    return input_media(
+                        await self.app.invoke(
+                            raw.functions.messages.UploadMedia(
+                                peer=await self.app.resolve_peer(dest_id),
+                                media=media,
+                            )
+                        )
+                    )
+            except (FloodWait, FloodPremiumWait) as e:
+                await self.flood_wait(e, progress, message.id)
+
+    async def send_album(self, dest_id, medias, messages, progress):
+        multi_media = []
+        for media, message in zip(medias, messages):
+            multi_media.append(
+                raw.types.InputSingleMedia(
+                    media=media,
+                    random_id=self.app.rnd_id(),
+                    **await utils.parse_text_entities(
+                        self.app,
+                        message.caption or "",
+                        None,
+                        message.caption_entities,
+                    ),
+                )
+            )
+
+        with metrics.stage_seconds.time("send"):
+            while True:
+                try:
+                    with self.tracer.span("send_album", messages[0].id):
+                        return await self.app.invoke(
+                            raw.functions.messages.SendMultiMedia(
+                                peer=await self.app.resolve_peer(dest_id),
+                                multi_media=multi_media,
+                            )
+                        )
+                except (FloodWait, FloodPremiumWait) as e:
+                    await self.flood_wait(e, progress, messages[0].id)
+
+    def record_saved(self, job, message):
+        # the bytes the upload cache spared, kept with the job across restarts
+        media = message.video or message.photo
+        job.update(
+            saved_bytes=job.params.get("saved_bytes", 0) + (media.file_size or 0)
+        )
+
+    def saved_text(self, job):
+        saved = job.params.get("saved_bytes", 0)
+        if not saved:
+            return ""
+        return f"\n{saved / 1024 / 1024:.1f} MB were not transferred again thanks to the upload cache"
+
+    async def download_and_upload(self, message_or_id, src_id, dest_ids, progress):
+        downloaded = await self.download_stage(message_or_id, src_id, progress)
+        media = await self.upload_stage(downloaded, progress)
+        return await self.commit_stage(downloaded, media, dest_ids, progress)
 
     async def archive_existing_videos(
-        self, src_id, segment, dest_id, safe, bar_message, src_link=""
+        self,
+        src_id,
+        segment,
+        dest_ids,
+        safe,
+        progress,
+        job,
+        src_link="",
+        mode="forward",
     ):
         print("Archiving historical videos...")
         src_chann = await self.app.get_chat(src_id)
 
         if src_chann.has_protected_content:
             await self.archive_protected(
-                src_id, segment, dest_id, safe, bar_message, src_link=src_link
+                src_id, segment, dest_ids, safe, progress, job, src_link=src_link
             )
         else:
-            # await self.archive_non_protected(src_id, segment, dest_id, bar_message)
-            await self.app.edit_message_text(
-                bar_message.chat.id,
-                bar_message.id,
-                "No need for a bar, channel is not protected, just chill a little bit",
+            await progress.status(
+                "Channel is not protected, scanning the videos to forward them in chunks..."
+            )
+            await self.archive_non_protected(
+                src_id, segment, dest_ids, progress, job, copy=mode == "copy"
             )
-            await self.archive_non_protected(src_id, segment, dest_id, bar_message)
 
-    async def archive_protected(
-        self, src_id, segment, dest_id, safe, bar_message, src_link=""
+    async def search_media_chunk(
+        self, chat_id, media_filter, add_offset=0, limit=100, offset_id=0, min_id=0
     ):
-        video_messages_or_ids = []
-        src_invite_link = ""
-        if safe == "safe":  # store the ids only
-            async for message in self.app.get_chat_history(src_id):
-                if message.video or message.photo:
-                    video_messages_or_ids.append(message.id)
+        r = await self.app.invoke(
+            raw.functions.messages.Search(
+                peer=await self.app.resolve_peer(chat_id),
+                q="",
+                filter=media_filter.value(),
+                min_date=0,
+                max_date=0,
+                offset_id=offset_id,
+                add_offset=add_offset,
+                limit=limit,
+                min_id=min_id,
+                max_id=0,
+                hash=0,
+            ),
+            sleep_threshold=60,
+        )
+        return await utils.parse_messages(self.app, r, replies=0)
+
+    async def search_media_range(self, chat_id, media_filter, media_count, start, end):
+        # the n-th oldest media message is (media_count - n) messages away from the newest
+        if start > end:
+            return []
 
-            await self.app.edit_message_text(
-                bar_message.chat.id,
-                bar_message.id,
-                "Safe no kick mode is on, this give higher stability, but If you were kicked, it is the end",
+        first = await self.search_media_chunk(
+            chat_id, media_filter, add_offset=media_count - start, limit=1
+        )
+        last = await self.search_media_chunk(
+            chat_id, media_filter, add_offset=media_count - end, limit=1
+        )
+        if not first or not last:
+            return []
+        min_id, max_id = first[0].id, last[0].id
+
+        media = []
+        offset_id = max_id + 1
+        while offset_id > min_id:
+            chunk = await self.search_media_chunk(
+                chat_id, media_filter, offset_id=offset_id, min_id=min_id - 1
             )
-        else:  # store the whole message
+            chunk = [message for message in chunk if min_id <= message.id < offset_id]
+            if not chunk:
+                break
+            media.extend(chunk)
+            offset_id = chunk[-1].id
+
+        return media[::-1]
+
+    async def search_media_since(self, chat_id, min_id):
+        offset_id = 0
+        while True:
+            chunk = await self.search_media_chunk(
+                chat_id,
+                enums.MessagesFilter.PHOTO_VIDEO,
+                offset_id=offset_id,
+                min_id=min_id,
+            )
+            chunk = [message for message in chunk if message.id > min_id]
+            if not chunk:
+                return
+            for message in chunk:
+                yield message
+            offset_id = chunk[-1].id
+
+    async def refresh_index(self, src_id):
+        max_id = self.index.max_id(src_id)
+        if SCAN_MODE == "history":
+            messages = self.app.get_chat_history(src_id, min_id=max_id)
+        else:
+            messages = self.search_media_since(src_id, max_id)
+
+        newest = max_id
+        batch = []
+        async for message in messages:
+            newest = max(newest, message.id)
+            batch.append(message)
+            if len(batch) == 100:
+                self.index.add(src_id, batch)
+                batch = []
+        self.index.add(src_id, batch)
+        # only recorded once the whole gap is indexed, an interrupted scan is redone
+        self.index.set_max_id(src_id, newest)
+
+    async def fetch_messages(self, chat_id, ids):
+        messages = []
+        for i in range(0, len(ids), 200):
+            chunk = await self.app.get_messages(chat_id, ids[i : i + 200])
+            messages.extend(message for message in chunk if not message.empty)
+        return messages
+
+    async def collect_media(self, src_id, segment, progress, videos_only=False):
+        if self.index is not None:
+            await self.refresh_index(src_id)
+            kinds = ("video",) if videos_only else ("video", "photo")
+            media_count = self.index.count(src_id, kinds)
+        elif SCAN_MODE == "history":
+            media = []
             async for message in self.app.get_chat_history(src_id):
-                if message.video or message.photo:
-                    video_messages_or_ids.append(message)
-
-            await self.app.edit_message_text(
-                bar_message.chat.id,
-                bar_message.id,
-                f"non-safe mode is on, Messages Objects Copied 100% {"exiting...." if safe == "no approval" else "staying as link requires approval"}",
+                if message.video or (message.photo and not videos_only):
+                    media.append(message)
+            media_count = len(media)
+        else:
+            media_filter = (
+                enums.MessagesFilter.VIDEO
+                if videos_only
+                else enums.MessagesFilter.PHOTO_VIDEO
+            )
+            media_count = await self.app.search_messages_count(
+                src_id, filter=media_filter
             )
-            if safe == "no approval":
-                if "https" in src_link:
-                    await self.app.leave_chat(src_id)
-                else:
-                    await bar_message.reply(
-                        "Not leaving because src_link is not a link"
-                    )
-
-        videos_count = len(video_messages_or_ids)
 
-        if segment[0] and segment[0] > videos_count:
-            await self.app.edit_message_text(
-                bar_message.chat.id,
-                bar_message.id,
+        if segment[0] and segment[0] > media_count:
+            await progress.status(
                 f"""
-                You want to start with video number {segment[0]}, the whole channel contain {videos_count} videos. 
-                """,
+                You want to start with video number {segment[0]}, the whole channel contain {media_count} videos. 
+                """
             )
             return
-        if segment[1] and segment[1] > videos_count:
-            await self.app.edit_message_text(
-                bar_message.chat.id,
-                bar_message.id,
+        if segment[1] and segment[1] > media_count:
+            await progress.status(
                 f"""
-                there is not video number {segment[1]} to include, the whole channel contain {vidoes_count}
-                """,
+                there is not video number {segment[1]} to include, the whole channel contain {media_count}
+                """
             )
             return
 
-        start = segment[0] - 1 if not segment[0] is None else 0
-        video_messages_or_ids = video_messages_or_ids[::-1][start : segment[1]]
-        videos_count = len(video_messages_or_ids)
+        start = segment[0] or 1
+        end = segment[1] or media_count
+        if self.index is not None:
+            return self.index.ids(src_id, kinds, start - 1, max(end - start + 1, 0))
 
-        failed = 0
-        for i, video_message in enumerate(video_messages_or_ids):
-            try:
-                res = await self.download_and_upload(
-                    video_message, src_id, dest_id, bar_message
+        if SCAN_MODE == "history":
+            media = media[::-1][start - 1 : end]
+        else:
+            media = await self.search_media_range(
+                src_id, media_filter, media_count, start, end
+            )
+        return [message.id for message in media]
+
+    async def plan_job(self, job, src_id, segment, progress, videos_only):
+        # returns the source ids still to be copied, the segment is only
+        # resolved once per job, resumed jobs continue from the journal
+        if job.plan is None:
+            with metrics.stage_seconds.time("history"):
+                ids = await self.collect_media(
+                    src_id, segment, progress, videos_only=videos_only
                 )
-                if res == "fail":
-                    failed += 1
+            if ids is None:
+                return
+            job.set_plan(ids)
+
+        return job.remaining()
+
+    async def archive_protected(
+        self, src_id, segment, dest_ids, safe, progress, job, src_link=""
+    ):
+        video_messages_or_ids = await self.plan_job(
+            job, src_id, segment, progress, videos_only=False
+        )
+        if video_messages_or_ids is None:
+            return
+
+        if safe == "safe":  # store the ids only
+            await progress.status(
+                "Safe no kick mode is on, this give higher stability, but If you were kicked, it is the end"
+            )
+        else:  # store the whole message
+            video_messages_or_ids = await self.fetch_messages(
+                src_id, video_messages_or_ids
+            )
+            await progress.status(
+                f"non-safe mode is on, Messages Objects Copied 100% {"exiting...." if safe == "no approval" else "staying as link requires approval"}"
+            )
+            if safe == "no approval":
+                if "https" in src_link:
+                    await self.app.leave_chat(src_id)
                 else:
-                    failed = 0
+                    await progress.reply("Not leaving because src_link is not a link")
 
-                if failed == 5:
-                    raise FileReferenceExpired
+        videos_count = len(job.plan)
 
-            except FileReferenceExpired:
-                try:
-                    fresh_src = await self.resolve_channel_id(src_link)
-                    segment[0] += i - 4
-                    await bar_message.reply("Refreshing the link succedded")
-                    await self.archive_protected(
-                        fresh_src.id,
-                        segment,
-                        dest_id,
-                        safe,
-                        bar_message,
-                        src_link=src_link,
-                    )
-                    return
-                except InviteHashExpired:
-                    await bar_message.reply_text(
-                        "It looks like the link of the channel is no longer working.",
-                        quote=True,
-                    )
-                    return
+        # failed items are only journaled once a later item succeeds, so
+        # they are retried after the link is refreshed on a streak of 5
+        failed = []
+        # (message id, downloaded, media) of the media group being collected
+        album = []
 
-            elapsed = (datetime.now() - bar_message.date).seconds
-            bar = tqdm.format_meter(
-                n=i + 1,
-                total=videos_count,
-                elapsed=elapsed,
-                prefix="Downloading",
-                unit="video",
-            )
-            await self.app.edit_message_text(bar_message.chat.id, bar_message.id, bar)
-
-    async def archive_non_protected(self, src_id, segment, dest_id, bar_message):
-        # async def archive_non_protected(self, src_id, segment, dest_id):
-        video_ids = []
-        async for message in self.app.get_chat_history(src_id):
-            if message.video:
-                video_ids.append(message.id)
-
-        videos_count = len(video_ids)
-        if segment[0] and segment[0] > videos_count:
-            await self.app.edit_message_text(
-                bar_message.chat.id,
-                bar_message.id,
-                f"""
-                You want to start with video number {segment[0]}, the whole channel contain {videos_count} videos. 
-                """,
+        def record(message_id, downloaded, res):
+            metrics.items.inc(res or "done")
+            if res == "fail":
+                failed.append(message_id)
+            else:
+                if res == "cached":
+                    self.record_saved(job, downloaded["message"])
+                job.mark_done(*failed, message_id)
+                failed.clear()
+
+        async def flush_album():
+            if not album:
+                return
+            items = album[:]
+            album.clear()
+            results = await self.commit_album(
+                [(downloaded, media) for _, downloaded, media in items],
+                dest_ids,
+                progress,
             )
-            return
-        if segment[1] and segment[1] > videos_count:
-            await self.app.edit_message_text(
-                bar_message.chat.id,
-                bar_message.id,
-                f"""
-                there is not video number {segment[1]} to include, the whole channel contain {vidoes_count}
-                """,
+            for (message_id, downloaded, _), res in zip(items, results):
+                record(message_id, downloaded, res)
+
+        async def commit(video_message, downloaded, media):
+            message_id = (
+                video_message if isinstance(video_message, int) else video_message.id
             )
+            message = downloaded["message"]
+            group = message.media_group_id if message and media else None
+            if album and (
+                album[0][1]["message"].media_group_id != group
+                or len(album) == ALBUM_SIZE
+            ):
+                await flush_album()
+
+            if group:
+                # the file is uploaded already, its disk space is not held
+                # while the rest of the group comes, a big album would wait
+                # on its own reservations
+                self.discard_downloaded(downloaded)
+                album.append((message_id, downloaded, media))
+            else:
+                record(
+                    message_id,
+                    downloaded,
+                    await self.commit_stage(downloaded, media, dest_ids, progress),
+                )
+
+            if len(failed) >= 5:
+                raise FileReferenceExpired
+
+            await progress.update(n=len(job.done) + len(failed), total=videos_count)
+
+        pipeline = TransferPipeline(
+            download=lambda video_message, ticket: self.download_stage(
+                video_message, src_id, progress, ticket
+            ),
+            upload=lambda _, downloaded: self.upload_stage(downloaded, progress),
+            commit=commit,
+            discard=lambda _, downloaded: self.discard_downloaded(downloaded),
+            download_workers=DOWNLOAD_WORKERS,
+            upload_workers=UPLOAD_WORKERS,
+            buffer_size=PIPELINE_BUFFER,
+            controller=self.concurrency,
+            take=lambda _: self.scratch.ticket(),
+        )
+
+        try:
+            try:
+                await pipeline.run(video_messages_or_ids)
+                await flush_album()
+            finally:
+                for _, downloaded, _ in album:
+                    self.discard_downloaded(downloaded)
+            job.mark_done(*failed)
+        except FileReferenceExpired:
+            try:
+                fresh_src = await self.resolve_channel_id(src_link)
+                await progress.reply("Refreshing the link succedded")
+                await self.archive_protected(
+                    fresh_src.id,
+                    segment,
+                    dest_ids,
+                    safe,
+                    progress,
+                    job,
+                    src_link=src_link,
+                )
+                return
+            except InviteHashExpired:
+                await progress.reply_text(
+                    "It looks like the link of the channel is no longer working.",
+                    quote=True,
+                )
+                return
+
+    async def archive_non_protected(
+        self, src_id, segment, dest_ids, progress, job, copy=False
+    ):
+        video_ids = await self.plan_job(
+            job, src_id, segment, progress, videos_only=True
+        )
+        if video_ids is None:
             return
-        start = segment[0] - 1 if not segment[0] is None else 0
-        video_ids = video_ids[::-1][start : segment[1]]
 
-        # forward messages indivisually
-        for video_message_id in tqdm(video_ids, unit="video", desc="Forwarding"):
+        progress.prefix = "Copying" if copy else "Forwarding"
+
+        # forward (or copy, with drop_author) in chunks, the chunk is halved
+        # on every FloodWait and doubled again after a few clean chunks
+        chunk_size = FORWARD_CHUNK
+        clean_chunks = 0
+        chunks_count = 0
+        position = 0
+        # the destinations the current chunk still has to reach
+        pending = list(dest_ids)
+        while position < len(video_ids):
+            chunk = video_ids[position : position + chunk_size]
+            # the limiter sleeps on the shorter FloodWaits itself, they count too
+            flood_waits = self.app.limiter.flood_waits("forward")
             try:
-                await self.app.forward_messages(dest_id, src_id, video_message_id)
+                while pending:
+                    with self.tracer.span("forward", chunk[0]):
+                        await self.app.forward_messages(
+                            pending[0], src_id, chunk, drop_author=copy or None
+                        )
+                    pending.pop(0)
             except (FloodWait, FloodPremiumWait) as e:
+                # a chunk some destinations already got is kept as it is
+                if len(pending) == len(dest_ids):
+                    chunk_size = max(1, chunk_size // 2)
+                clean_chunks = 0
                 wait_period = timedelta(seconds=e.value)
                 now = datetime.now(self.tz)
                 end_time = (now + wait_period).strftime("%H:%M:%S")
                 cause = re.search(r"(\(.+\))", str(e))
                 print(f"Flood wait: {e.value} seconds")
-                await bar_message.reply_text(
-                    f"FloodWait: {wait_period.seconds//60}:{wait_period.seconds%60}, Ends {end_time}, last message id:{video_message_id}, {cause}",
+                await progress.reply_text(
+                    f"FloodWait: {wait_period.seconds//60}:{wait_period.seconds%60}, Ends {end_time}, last message id:{chunk[0]}, {cause}, chunk size is now {chunk_size}",
                     quote=True,
                 )
 
-                await asyncio.sleep(e.value + 1)
-                await self.app.forward_messages(dest_id, src_id, video_message_id)
-
-        # forward in chunks
-        # it = iter(video_ids)
-        # messages_chunks = list(iter(lambda: list(islice(it, 100)), []))
-        # #
-        # print(
-        #     f"{len(video_ids)} vidoes found, divided into {len(messages_chunks)} chunks."
-        # )
-        #
-        # for i, chunk in enumerate(messages_chunks):
-        #     try:
-        #         await self.app.forward_messages(
-        #             dest_id,
-        #             src_id,
-        #             chunk,
-        #         )
-        #
-        #         elapsed = (datetime.now(self.tz) - bar_message.date).seconds
-        #         bar = tqdm.format_meter(
-        #             n=i + 1,
-        #             total=len(messages_chunks),
-        #             elapsed=elapsed,
-        #             prefix="Forwarding",
-        #             unit="chunk",
-        #         )
-        #         await self.app.edit_message_text(bar_message.chat.id, bar_message.id, bar)
-        #
-        # except FloodWait as e:
-        #     print(f"Flood wait: {e.value} seconds")
-        #         wait_period = timedelta(seconds=e.value)
-        #         now = datetime.now(self.tz)
-        #         end_time = (now + wait_period).strftime("%H:%M:%S")
-        #         cause = re.search(r"(\(.+\))", str(e))
-        #         await bar_message.reply_text(
-        #             f"FloodWait: {wait_period.seconds//60}:{wait_period.seconds%60}, Ends {end_time}, {cause}", quote=True
-        #         )
-        #     await asyncio.sleep(e.value)
-        #     await self.app.forward_messages(
-        #         dest_id,
-        #         src_id,
-        #         chunk,
-        #     )
+                with self.tracer.span("flood_wait", chunk[0]):
+                    await asyncio.sleep(e.value + 1)
+                continue
+
+            job.mark_done(*chunk)
+            metrics.items.inc("forwarded", amount=len(chunk))
+            pending = list(dest_ids)
+            position += len(chunk)
+            chunks_count += 1
+            clean_chunks += 1
+            if self.app.limiter.flood_waits("forward") > flood_waits:
+                chunk_size = max(1, chunk_size // 2)
+                clean_chunks = 0
+                print(f"forwarding hit a FloodWait, chunk size is now {chunk_size}")
+            if clean_chunks == 3 and chunk_size < FORWARD_CHUNK:
+                chunk_size = min(FORWARD_CHUNK, chunk_size * 2)
+                clean_chunks = 0
+
+            await progress.update(
+                n=len(job.done),
+                total=len(job.plan),
+                postfix=f"{chunks_count} chunks, chunk size {chunk_size}",
+            )
 
     @allow_cancellation
     async def channel_to_file(self, chann_link, command_message):
@@ -693,146 +1493,324 @@ class ChannelCopier:
         else:
             await command_message.reply_text("Chat Found, Exctracting content")
 
-        messages = []
-        async for message in self.app.get_chat_history(src_chann.id):
-            messages.append(message)
+        file_name = src_chann.title + export_format.SUFFIX
+        try:
+            # the records are written as the history is fetched, so memory stays flat
+            with export_format.ExportWriter(file_name, src_chann.title) as writer:
+                async for message in self.app.get_chat_history(src_chann.id):
+                    writer.write(message)
+
+            try:
+                await self.app.send_document(
+                    command_message.chat.id,
+                    file_name,
+                    caption=f"{writer.count} messages exported",
+                )
+            except Exception as e:
+                await command_message.reply_text(f"Error sending file, {e}")
 
-        file_name = src_chann.title + "-history(pickled)"
+        finally:
+            if os.path.exists(file_name):
+                os.remove(file_name)
 
-        with open(file_name, "wb") as f:
-            pickle.dump(messages, f)
+    def read_import_file(self, file_path):
+        # returns (items, count), items are yielded lazily from exported files,
+        # count is None when it is only known once the whole file is read
+        with open(file_path, "rb") as f:
+            is_export = f.read(2) == b"\x1f\x8b"  # gzip magic number
 
-        try:
-            await self.app.send_document(command_message.chat.id, file_name)
-        except Exception as e:
-            await command_message.reply_text(f"Error sending file, {e}")
+        if is_export:
+            records = export_format.read_records(file_path)
+            return (export_format.record_message(r) for r in records), None
 
-        if os.path.exists(file_name):
-            os.remove(file_name)
+        # a legacy pickled list can only be loaded as a whole
+        with open(file_path, "rb") as f:
+            items = pickle.load(f)
+        if not isinstance(items, list):
+            raise TypeError
+        return iter(items), len(items)
 
     @allow_cancellation
-    async def file_to_channel(self, command_message: Message):
+    async def file_to_channel(self, command_message: Message, job=None):
         print("a file to channel process started")
         if not command_message.document:
             await command_message.reply("You need to attach the file to the message")
             return
 
-        file_path = await self.app.download_media(command_message.document.file_id)
+        document = command_message.document
+        # kept until the job ends, the downloads of its items must not wait on it
+        scratch = await self.scratch.reserve(document.file_size or 0, pinned=True)
+        items = None
         try:
-            with open(file_path, "rb") as f:
-                messages = pickle.load(f)
-        except TypeError:
-            await command_message.reply(
-                "The file content must be a binary pickled list[pyrogram.types.Messages] object."
+            file_path = await self.app.download_media(
+                document.file_id, file_name=scratch.directory
             )
-            return
-        except UnpicklingError:
-            await command_message.reply("The file is corrupted")
-            return
+            try:
+                items, items_count = self.read_import_file(file_path)
+                # only parse up to the first message before creating the channel
+                first, other_types = None, set()
+                for item in items:
+                    if isinstance(item, Message):
+                        first = item
+                        break
+                    other_types.add(type(item))
+            except TypeError:
+                await command_message.reply(
+                    "The file content must be a binary pickled list[pyrogram.types.Messages] object, or an exported history."
+                )
+                return
+            except (UnpicklingError, ValueError, EOFError, OSError):
+                await command_message.reply("The file is corrupted")
+                return
 
-        messages_exist = False
-        all_messages = True
-        types = set()
-        for message in messages:
-            if isinstance(message, Message) and not messages_exist:
-                messages_exist = True
+            if first is None:
+                await command_message.reply(
+                    f"""
+                    The file is intact but it doesn't contain any item of type <class pyrogram.types.Message>
+                    the content of the file is of types {other_types}
+                    """
+                )
+                return
 
-            elif not isinstance(message, Message):
-                if all_messages:
-                    all_messages = False
+            await command_message.reply(
+                """The file is readable, starting the operation, the rest of it is checked while uploading.."""
+            )
 
-                types.add(type(message))
+            if job is not None and job.params.get("dest_id"):
+                dest_chann = await self.app.get_chat(job.params["dest_id"])
+            else:
+                title = (
+                    document.file_name.replace("-history(pickled)", "").replace(
+                        export_format.SUFFIX, ""
+                    )
+                    + " from file"
+                )
+                dest_chann_id = await self.create_destination_channel(title)
+                dest_chann = await self.app.get_chat(dest_chann_id)
+                if job is None:
+                    job = self.journal.create(
+                        "file_to_channel",
+                        {
+                            "chat_id": command_message.chat.id,
+                            "message_id": command_message.id,
+                            "file_name": document.file_name,
+                            "dest_id": dest_chann.id,
+                        },
+                    )
+                else:
+                    job.update(dest_id=dest_chann.id)
 
-        if not messages_exist:
             await command_message.reply(
                 f"""
-                The file is intact but it doesn't contain any item of type <class pyrogram.types.Message>
-                the content of the file is of types {types}
+                You can follow up here: {dest_chann.invite_link}
                 """
             )
-            return
 
-        elif not all_messages:
-            await command_message.reply(
-                f"""
-                Warning: the file is intact and contain messages, but it also contain other types such as {types}\n
-                starting the operation the  available messages though... 
-                """
+            bar_message = await command_message.reply("Progress Bar")
+            await bar_message.pin(both_sides=True)
+            progress = ProgressReporter(
+                bar_message,
+                prefix="Uploading...",
+                unit="message",
+                interval=PROGRESS_INTERVAL,
+            )
+            self.attach_progress(progress)
+            await self.run_job(
+                job,
+                self.messages_to_channel(
+                    itertools.chain([first], items),
+                    items_count,
+                    other_types,
+                    dest_chann,
+                    command_message,
+                    progress,
+                    job,
+                ),
             )
+            await progress.flush()
 
-            messages = filter(lambda m: isinstance(m, Message))
+        finally:
+            if hasattr(items, "close"):
+                items.close()
+            scratch.release()
 
-        else:
+    async def messages_to_channel(
+        self,
+        messages,
+        messages_count,
+        other_types,
+        dest_chann,
+        command_message,
+        progress,
+        job,
+    ):
+        warned = bool(other_types)
+        if warned:
             await command_message.reply(
-                """The file is intact, the content is messages, starting the operation.."""
+                f"""
+                Warning: the file contain other types than messages such as {other_types}, skipping them...
+                """
             )
 
-        title = (
-            command_message.document.file_name.replace("-history(pickled)", "")
-            + " from file"
-        )
-        dest_chann_id = await self.create_destination_channel(title)
-        dest_chann = await self.app.get_chat(dest_chann_id)
+        # (message, downloaded, media) of the media group being collected
+        album = []
 
-        await command_message.reply(
-            f"""
-            You can follow up here: {dest_chann.invite_link}
-            """
-        )
+        async def flush_album():
+            if not album:
+                return
+            items = album[:]
+            album.clear()
+            results = await self.commit_album(
+                [(downloaded, media) for _, downloaded, media in items],
+                [dest_chann.id],
+                progress,
+            )
+            for (message, _, _), res in zip(items, results):
+                metrics.items.inc(res or "done")
+                if res == "cached":
+                    self.record_saved(job, message)
+                job.mark_done(message.id)
 
-        bar_message = await command_message.reply("Progress Bar")
-        await bar_message.pin(both_sides=True)
-        messages_count = len(messages)
-        for i, message in enumerate(messages):
-            try:
-                if message.video or message.photo:
-                    await self.download_and_upload(
-                        message, None, dest_chann.id, bar_message
+        try:
+            while True:
+                try:
+                    message = next(messages)
+                except StopIteration:
+                    break
+                except (UnpicklingError, ValueError, EOFError, OSError) as e:
+                    await command_message.reply(
+                        f"The rest of the file is corrupted ({e}), stopping after {len(job.done)} messages"
                     )
+                    break
+
+                if not isinstance(message, Message):
+                    if not warned:
+                        warned = True
+                        await command_message.reply(
+                            f"""
+                            Warning: the file is intact and contain messages, but it also contain other types such as {type(message)}\n
+                            starting the operation the  available messages though... 
+                            """
+                        )
+                    continue
+
+                if message.id in job.done:
+                    continue
 
-                elif message.text:
-                    await self.app.send_message(dest_chann.id, message.text)
-                elif message.document:
-                    await self.app.send_document(
-                        dest_chann.id, message.document.file_id, caption=message.caption
-                    )
-                elif message.audio:
-                    await self.app.send_audio(
-                        dest_chann.id, message.audio.file_id, caption=message.caption
+                try:
+                    if album and (
+                        album[0][0].media_group_id != message.media_group_id
+                        or len(album) == ALBUM_SIZE
+                    ):
+                        await flush_album()
+
+                    if message.media_group_id and (message.video or message.photo):
+                        downloaded = await self.download_stage(message, None, progress)
+                        media = await self.upload_stage(downloaded, progress)
+                        if media:
+                            # uploaded already, see archive_protected
+                            self.discard_downloaded(downloaded)
+                            album.append((message, downloaded, media))
+                            continue
+                        # reported (and discarded) by commit_stage
+                        await self.commit_stage(
+                            downloaded, media, [dest_chann.id], progress
+                        )
+
+                    elif message.video or message.photo:
+                        res = await self.download_and_upload(
+                            message, None, [dest_chann.id], progress
+                        )
+                        metrics.items.inc(res or "done")
+                        if res == "cached":
+                            self.record_saved(job, message)
+
+                    elif message.text:
+                        await self.app.send_message(dest_chann.id, message.text)
+                    elif message.document:
+                        await self.app.send_document(
+                            dest_chann.id,
+                            message.document.file_id,
+                            caption=message.caption,
+                        )
+                    elif message.audio:
+                        await self.app.send_audio(
+                            dest_chann.id,
+                            message.audio.file_id,
+                            caption=message.caption,
+                        )
+
+                except TypeError:
+                    pass
+                except FileReferenceExpired:
+                    await self.app.send_message(dest_chann.id, "an expired file")
+                    await command_message.reply(
+                        f"""
+                        expired file was encountered, this cause process termination, here is the result {dest_chann.invite_link}
+                        """
                     )
+                    return
 
-            except TypeError:
-                pass
-            except FileReferenceExpired:
-                await self.app.send_message(dest_chann.id, "an expired file")
-                await command_message.reply(
-                    f"""
-                    expired file was encountered, this cause process termination, here is the result {dest_chann.invite_link}
-                    """
-                )
-                return
+                job.mark_done(message.id)
 
-            elapsed = (datetime.now() - bar_message.date).seconds
-            bar = tqdm.format_meter(
-                n=i + 1,
-                total=messages_count,
-                elapsed=elapsed,
-                prefix="Uploading...",
-                unit="message",
-            )
-            await bar_message.edit_text(bar)
+                await progress.update(n=len(job.done), total=messages_count)
+
+            await flush_album()
+            await progress.update(n=len(job.done), total=messages_count)
+        finally:
+            for _, downloaded, _ in album:
+                self.discard_downloaded(downloaded)
 
         await command_message.reply(
             f"""
             Mission Completed, here you are {dest_chann.invite_link}
             """
+            + self.saved_text(job)
         )
 
+    def attach_progress(self, progress):
+        # lets the http server show the progress of the task running this
+        current = asyncio.current_task()
+        for task in self.state.values():
+            if task["task"] is current:
+                task["progress"] = progress
+
+    def jobs_view(self):
+        queued = self.scheduler.queued()
+        jobs = []
+        for task_id, task in self.state.items():
+            view = {
+                "id": task_id,
+                "type": task["type"],
+                "target": task["target"],
+                "started": task["started"].isoformat(),
+                "status": "queued" if task_id in queued else "running",
+            }
+            progress = task.get("progress")
+            if progress is not None:
+                view.update(
+                    done=progress.n,
+                    total=progress.total,
+                    items_per_second=progress.rate(),
+                    eta_seconds=progress.eta(),
+                )
+            jobs.append(view)
+        return {"tasks_count": self.tasks_count, "jobs": jobs}
+
     async def get_state(self, message):
         state = f"tasks count is {self.tasks_count}.\n"
+        concurrency = self.concurrency
+        state += (
+            f"transfer concurrency is {concurrency.limit} "
+            f"({concurrency.minimum} to {concurrency.maximum}), "
+            f"{concurrency.in_use} downloads running.\n"
+        )
+        queued = self.scheduler.queued()
         for k in self.state:
             task = self.state[k]
             task_str = f"\n\ttask{k}:\n\ttype: {task["type"]}\n\ttarget: {task["target"]}\n\tstarted: {task["started"]}"
+            if k in queued:
+                task_str += f"\n\tqueued: {queued.index(k) + 1} of {len(queued)}"
             state += task_str
 
         if not len(self.state):
@@ -860,7 +1838,26 @@ class ChannelCopier:
             return
 
         task = self.state[task_id]["task"]
+        queued = task_id in self.scheduler.queued()
         task.cancel()
+        if queued:
+            # it never started, so no cancellation reply comes from the task
+            await message.reply("The task has been removed from the queue", quote=True)
+
+    async def profile_task(self, message, task_id):
+        profile = self.tracer.profile(task_id)
+        if profile is None:
+            await message.reply_text(f"No spans were traced for task {task_id}")
+            return
+        await message.reply_text(profile, quote=True)
+
+    async def promote_task(self, message, task_id):
+        if self.scheduler.promote(task_id):
+            await message.reply(
+                f"task{task_id} will be the next one to start", quote=True
+            )
+        else:
+            await message.reply(f"task{task_id} is not queued", quote=True)
 
     async def send_regularly(self, chat_link, text, interval):
         my_id = (await self.app.get_me()).id
@@ -914,9 +1911,17 @@ class ChannelCopier:
         except Exception as e:
             print(e)
 
+        self.stopping = True
         for task_id in self.state:
             self.state[task_id]["task"].cancel()
 
+        if self.index is not None:
+            self.index.close()
+        if self.uploads is not None:
+            self.uploads.close()
+
+        await self.sessions.stop()
+        await self.http.stop()
         await self.app.stop()
         # sys.exit(0)
 
@@ -0,0 +1,198 @@
+import asyncio
+
+
+class TransferPipeline:
+    """
+    download -> (reorder buffer) -> upload -> commit
+
+    `download_workers` items are fetched concurrently, at most `buffer_size`
+    items are held between being taken from the source and being committed,
+    uploads run on `upload_workers` workers and `commit` is always called in
+    the source order, so the destination receives the posts in order.
+    if the run is aborted, `discard` is called for every downloaded item that
+    was not handed to `commit`.
+    with a ConcurrencyController, `controller.maximum` download workers are
+    started and each download holds one of its slots.
+    `take` is called with every item in the order the items are taken, its
+    result is passed to `download` as a second argument.
+    """
+
+    def __init__(
+        self,
+        download,
+        commit,
+        upload=None,
+        discard=None,
+        download_workers=2,
+        upload_workers=1,
+        buffer_size=4,
+        controller=None,
+        take=None,
+    ):
+        self.download = download
+        self.upload = upload
+        self.commit = commit
+        self.discard = discard
+        self.controller = controller
+        self.take = take
+        if controller is not None:
+            download_workers = max(download_workers, controller.maximum)
+        self.download_workers = max(1, download_workers)
+        self.upload_workers = max(1, upload_workers)
+        self.buffer_size = max(self.download_workers, buffer_size)
+
+        self.committed = 0
+
+    async def run(self, items):
+        self._is_async = hasattr(items, "__aiter__")
+        self._items = aiter(items) if self._is_async else iter(items)
+
+        self.committed = 0
+        self._taken = 0
+        self._exhausted = False
+        self._take_lock = asyncio.Lock()
+        self._slots = asyncio.Semaphore(self.buffer_size)
+        self._changed = asyncio.Condition()
+        self._downloaded = {}
+        self._uploaded = {}
+        self._upload_queue = asyncio.Queue(self.upload_workers)
+
+        workers = [
+            asyncio.create_task(self._download_worker())
+            for _ in range(self.download_workers)
+        ]
+        workers.append(asyncio.create_task(self._dispatcher()))
+        workers += [
+            asyncio.create_task(self._upload_worker())
+            for _ in range(self.upload_workers)
+        ]
+        committer = asyncio.create_task(self._committer())
+        workers.append(committer)
+
+        try:
+            done, _ = await asyncio.wait(workers, return_when=asyncio.FIRST_EXCEPTION)
+            for task in done:
+                if task.exception():
+                    raise task.exception()
+            await committer
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            self._discard_buffered()
+
+        return self.committed
+
+    def _discard_buffered(self):
+        if self.discard is None:
+            return
+
+        entries = list(self._downloaded.values()) + list(self._uploaded.values())
+        while not self._upload_queue.empty():
+            job = self._upload_queue.get_nowait()
+            if job is not None:
+                entries.append(job[1])
+        for item, data, *_ in entries:
+            self.discard(item, data)
+
+    async def _next_item(self):
+        async with self._take_lock:
+            if self._exhausted:
+                return None
+            try:
+                if self._is_async:
+                    item = await anext(self._items)
+                else:
+                    item = next(self._items)
+            except (StopIteration, StopAsyncIteration):
+                async with self._changed:
+                    self._exhausted = True
+                    self._changed.notify_all()
+                return None
+
+            index = self._taken
+            self._taken += 1
+            return index, item, self.take(item) if self.take else None
+
+    async def _download(self, item, token):
+        if self.take is None:
+            return await self.download(item)
+        return await self.download(item, token)
+
+    async def _download_worker(self):
+        while True:
+            await self._slots.acquire()
+            # the slot is held before the item is taken, so nothing can
+            # interrupt between `take` and `download`
+            if self.controller is not None:
+                await self.controller.acquire()
+            taken = await self._next_item()
+            if taken is None:
+                self._slots.release()
+                if self.controller is not None:
+                    await self.controller.release()
+                return
+
+            index, item, token = taken
+            if self.controller is None:
+                data = await self._download(item, token)
+            else:
+                try:
+                    data = await self._download(item, token)
+                finally:
+                    await self.controller.release()
+                self.controller.completed()
+            async with self._changed:
+                self._downloaded[index] = (item, data)
+                self._changed.notify_all()
+
+    async def _wait_for(self, buffer, index):
+        async with self._changed:
+            await self._changed.wait_for(
+                lambda: index in buffer or (self._exhausted and index >= self._taken)
+            )
+            if index in buffer:
+                return buffer.pop(index)
+            return None
+
+    async def _dispatcher(self):
+        index = 0
+        while True:
+            entry = await self._wait_for(self._downloaded, index)
+            if entry is None:
+                for _ in range(self.upload_workers):
+                    await self._upload_queue.put(None)
+                return
+
+            await self._upload_queue.put((index, entry))
+            index += 1
+
+    async def _upload_worker(self):
+        while True:
+            job = await self._upload_queue.get()
+            if job is None:
+                return
+
+            index, (item, data) = job
+            try:
+                uploaded = await self.upload(item, data) if self.upload else None
+            except BaseException:
+                if self.discard is not None:
+                    self.discard(item, data)
+                raise
+            async with self._changed:
+                self._uploaded[index] = (item, data, uploaded)
+                self._changed.notify_all()
+
+    async def _committer(self):
+        index = 0
+        while True:
+            entry = await self._wait_for(self._uploaded, index)
+            if entry is None:
+                return
+
+            item, data, uploaded = entry
+            await self.commit(item, data, uploaded)
+            self.committed += 1
+            self._slots.release()
+            index += 1
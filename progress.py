@@ -0,0 +1,125 @@
+import asyncio
+import time
+
+from pyrogram.errors import FloodPremiumWait, FloodWait, RPCError
+
+
+class ProgressReporter:
+    """
+    keeps the state of a progress bar message locally and edits the message
+    at most once every `interval` seconds, and only when its text changed
+
+    an edit that fails is skipped, the next one shows the current state. the
+    edits have their own class in the RateLimiter, which never sleeps on them.
+    """
+
+    def __init__(self, bar_message, prefix="Downloading", unit="video", interval=5):
+        self.bar_message = bar_message
+        self.prefix = prefix
+        self.unit = unit
+        self.interval = interval
+
+        self.n = 0
+        self.total = None
+        self.counting = False
+        self.postfix = None
+        self.status_text = bar_message.text or ""
+        self.notes = []
+        self.started = time.monotonic()
+        self.first_count = None  # (n, time) of the first counted update
+
+        self.last_text = self.status_text
+        self.last_edit = 0
+        self.pending = None
+
+    def render(self):
+        if not self.counting:
+            text = self.status_text
+        else:
+            from tqdm import tqdm  # only needed once a bar is drawn
+
+            text = tqdm.format_meter(
+                n=self.n,
+                total=self.total,
+                elapsed=time.monotonic() - self.started,
+                prefix=self.prefix,
+                unit=self.unit,
+                postfix=self.postfix,
+            )
+        return "\n".join([text, *self.notes])
+
+    async def update(self, n=None, total=None, postfix=None, force=False):
+        if n is not None:
+            self.n = n
+            self.counting = True
+            if self.first_count is None:
+                self.first_count = (n, time.monotonic())
+        if total is not None:
+            self.total = total
+        if postfix is not None:
+            self.postfix = postfix
+
+        wait = self.last_edit + self.interval - time.monotonic()
+        if force or wait <= 0:
+            await self.flush()
+        elif self.pending is None:
+            # make sure the last update is shown even if no other one follows
+            self.pending = asyncio.create_task(self._flush_later(wait))
+
+    def rate(self):
+        # items per second of this run, resumed jobs start from their count
+        if self.first_count is None:
+            return None
+        first_n, first_time = self.first_count
+        elapsed = time.monotonic() - first_time
+        return (self.n - first_n) / elapsed if elapsed > 0 else None
+
+    def eta(self):
+        rate = self.rate()
+        if not rate or self.total is None:
+            return None
+        return max(self.total - self.n, 0) / rate
+
+    async def status(self, text):
+        # a free text shown in place of the bar until the next counted update
+        self.status_text = text
+        self.total = None
+        self.counting = False
+        await self.flush()
+
+    async def note(self, text):
+        # a line kept under the bar, e.g. the FloodWaits encountered
+        self.notes.append(text)
+        await self.flush()
+
+    async def _flush_later(self, delay):
+        await asyncio.sleep(delay)
+        self.pending = None
+        await self.flush()
+
+    async def flush(self):
+        if self.pending is not None and self.pending is not asyncio.current_task():
+            self.pending.cancel()
+            self.pending = None
+
+        text = self.render()
+        if text == self.last_text:
+            return
+
+        self.last_edit = time.monotonic()
+        try:
+            await self.bar_message.edit_text(text)
+        except (FloodWait, FloodPremiumWait) as e:
+            print(f"progress edit skipped, FloodWait of {e.value}s")
+            return
+        except RPCError as e:
+            # e.g. the bar message was deleted, the job goes on without it
+            print(f"progress edit failed: {e}")
+            return
+        self.last_text = text
+
+    async def reply(self, *args, **kwargs):
+        return await self.bar_message.reply(*args, **kwargs)
+
+    async def reply_text(self, *args, **kwargs):
+        return await self.bar_message.reply_text(*args, **kwargs)
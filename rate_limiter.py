@@ -0,0 +1,168 @@
+import asyncio
+import math
+import time
+
+from pyrogram import Client, raw
+from pyrogram.errors import FloodPremiumWait, FloodWait
+from pyrogram.session import Session
+
+import metrics
+
+METHOD_CLASSES = {
+    raw.functions.messages.SendMessage: "send",
+    raw.functions.messages.SendMedia: "send",
+    raw.functions.messages.SendMultiMedia: "send",
+    raw.functions.messages.EditMessage: "edit",
+    raw.functions.messages.UploadMedia: "send",
+    raw.functions.messages.ForwardMessages: "forward",
+    raw.functions.messages.GetHistory: "get_history",
+    raw.functions.messages.Search: "get_history",
+    raw.functions.messages.GetMessages: "get_history",
+    raw.functions.channels.GetMessages: "get_history",
+}
+
+
+class RateLimiter:
+    """
+    one pacing state per method class, shared by every task
+
+    a FloodWait pauses its class for everyone and doubles the gap kept between
+    the calls of that class, the gap then shrinks back on every success.
+    waits longer than `sleep_threshold` are re-raised to the caller after the
+    class is paused, so it can still report them.
+    the sleeps are traced as "flood_wait" or "pacing" spans if a tracer is given,
+    and every FloodWait is passed to the `flood_listeners` as (class, seconds).
+    the calls of the `skip_classes` are never slept on, a FloodWait or a pause
+    of their class is raised at once so the caller can skip them.
+    """
+
+    def __init__(
+        self,
+        sleep_threshold=60,
+        min_interval=0.5,
+        recovery=0.9,
+        tracer=None,
+        skip_classes=("edit",),
+    ):
+        self.sleep_threshold = sleep_threshold
+        self.skip_classes = skip_classes
+        self.min_interval = min_interval
+        self.recovery = recovery
+        self.tracer = tracer
+        self.flood_listeners = []
+        self.classes = {}
+
+    def _state(self, method_class):
+        if method_class not in self.classes:
+            self.classes[method_class] = {
+                "interval": 0,
+                "next": 0,
+                "paused_until": 0,
+                "lock": asyncio.Lock(),
+                "flood_waits": 0,
+            }
+        return self.classes[method_class]
+
+    async def acquire(self, method_class):
+        state = self._state(method_class)
+        async with state["lock"]:
+            while True:
+                wait = max(state["paused_until"], state["next"]) - time.monotonic()
+                if wait <= 0:
+                    break
+                if self.tracer is None:
+                    await asyncio.sleep(wait)
+                    continue
+                paused = state["paused_until"] > time.monotonic()
+                with self.tracer.span("flood_wait" if paused else "pacing"):
+                    await asyncio.sleep(wait)
+            state["next"] = time.monotonic() + state["interval"]
+
+    def flood(self, method_class, seconds):
+        state = self._state(method_class)
+        state["flood_waits"] += 1
+        metrics.flood_waits.inc(method_class)
+        metrics.flood_seconds.inc(method_class, amount=seconds)
+        state["paused_until"] = max(state["paused_until"], time.monotonic() + seconds)
+        state["interval"] = max(state["interval"] * 2, self.min_interval)
+        for listener in self.flood_listeners:
+            listener(method_class, seconds)
+
+    def flood_waits(self, method_class):
+        # the FloodWaits of the class so far, slept on here or re-raised
+        return self._state(method_class)["flood_waits"]
+
+    def succeeded(self, method_class):
+        state = self._state(method_class)
+        if state["interval"]:
+            state["interval"] *= self.recovery
+            if state["interval"] < self.min_interval / 10:
+                state["interval"] = 0
+
+    async def call(self, method_class, func, *args, **kwargs):
+        skip = method_class in self.skip_classes
+        while True:
+            paused = self._state(method_class)["paused_until"] - time.monotonic()
+            if skip and paused > 0:
+                raise FloodWait(value=math.ceil(paused))
+            await self.acquire(method_class)
+            try:
+                result = await func(*args, **kwargs)
+            except (FloodWait, FloodPremiumWait) as e:
+                print(f"{method_class} is paused for {e.value}s by a FloodWait")
+                self.flood(method_class, e.value)
+                if skip or e.value > self.sleep_threshold:
+                    raise
+                continue
+
+            self.succeeded(method_class)
+            return result
+
+
+class LimitedClient(Client):
+    """a Client that runs every request through a shared RateLimiter"""
+
+    def __init__(self, *args, limiter, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.limiter = limiter
+
+    async def invoke(self, query, *args, **kwargs):
+        # flood waits must reach the limiter instead of being slept on in place
+        kwargs["sleep_threshold"] = 0
+        return await self.limiter.call(
+            METHOD_CLASSES.get(type(query), "other"),
+            super().invoke,
+            query,
+            *args,
+            **kwargs,
+        )
+
+    async def download_media(self, *args, **kwargs):
+        return await self.limiter.call(
+            "download", super().download_media, *args, **kwargs
+        )
+
+    async def stream_media(self, *args, **kwargs):
+        await self.limiter.acquire("download")
+        try:
+            async for chunk in super().stream_media(*args, **kwargs):
+                yield chunk
+        except (FloodWait, FloodPremiumWait) as e:
+            self.limiter.flood("download", e.value)
+            raise
+
+    async def save_file(self, *args, **kwargs):
+        return await self.limiter.call("upload", super().save_file, *args, **kwargs)
+
+    async def media_session(self):
+        # a connection of its own to the media servers of the account's dc,
+        # the caller stops it. its requests are paced by the caller
+        session = Session(
+            self,
+            await self.storage.dc_id(),
+            await self.storage.auth_key(),
+            await self.storage.test_mode(),
+            is_media=True,
+        )
+        await session.start()
+        return session
@@ -0,0 +1,63 @@
+import asyncio
+import heapq
+import itertools
+
+
+class JobScheduler:
+    """
+    runs at most `limit` jobs at a time, the others wait in a queue ordered
+    by priority (lower first) then by arrival
+
+    the running jobs share the rate budget through the RateLimiter, whose
+    per class locks serve the waiting calls in arrival order.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.running = set()
+        self.queue = []  # heap of [priority, arrival, task id, future]
+        self.arrivals = itertools.count()
+
+    async def run(self, task_id, coro, priority=1):
+        if len(self.running) >= self.limit or self.queue:
+            future = asyncio.get_running_loop().create_future()
+            entry = [priority, next(self.arrivals), task_id, future]
+            heapq.heappush(self.queue, entry)
+            try:
+                await future
+            except asyncio.CancelledError:
+                coro.close()
+                if entry in self.queue:
+                    self.queue.remove(entry)
+                    heapq.heapify(self.queue)
+                elif future.done():
+                    # killed right after its turn came, give the slot on
+                    self.running.discard(task_id)
+                    self._start_next()
+                raise
+
+        self.running.add(task_id)
+        try:
+            return await coro
+        finally:
+            self.running.discard(task_id)
+            self._start_next()
+
+    def _start_next(self):
+        while self.queue and len(self.running) < self.limit:
+            _, _, task_id, future = heapq.heappop(self.queue)
+            if not future.done():
+                # the slot is taken now, before the job gets to run
+                self.running.add(task_id)
+                future.set_result(None)
+
+    def queued(self):
+        return [entry[2] for entry in sorted(self.queue)]
+
+    def promote(self, task_id):
+        for entry in self.queue:
+            if entry[2] == task_id:
+                entry[0] = min(e[0] for e in self.queue) - 1
+                heapq.heapify(self.queue)
+                return True
+        return False
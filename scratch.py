@@ -0,0 +1,101 @@
+import asyncio
+import collections
+import os
+import shutil
+import uuid
+
+
+class Reservation:
+    """a private directory in the scratch space, holding `size` bytes of the quota"""
+
+    def __init__(self, scratch, size, pinned=False):
+        self.scratch = scratch
+        self.size = size
+        self.pinned = pinned
+        self.directory = os.path.join(scratch.directory, uuid.uuid4().hex) + "/"
+        self.released = False
+
+    def release(self):
+        # safe to call more than once, and from every exit path
+        if self.released:
+            return
+        self.released = True
+        shutil.rmtree(self.directory, ignore_errors=True)
+        self.scratch._free(self)
+
+
+class ScratchSpace:
+    """
+    the disk space used by downloads, shared by all the tasks
+
+    `reserve` waits until the requested bytes fit in the quota, a file bigger
+    than what is left is let through once nothing else is reserved. a pinned
+    reservation is held for a whole job (the file of an import) and does not
+    count there, the items of that job would wait on it forever.
+    the reservations are served strictly in the order of their tickets, a
+    pipeline takes one per item in the order it takes the items so a later
+    item never holds the bytes an earlier one waits for. a reservation made
+    without a ticket, or with a cancelled one, is served first, its caller
+    has no place in a pipeline.
+    """
+
+    def __init__(self, directory, quota):
+        # absolute, pyrogram puts relative download paths under the script's folder
+        self.directory = os.path.abspath(directory)
+        self.quota = quota
+        self.used = 0
+        self.pinned = 0  # bytes of the pinned reservations, part of used
+        self.freed = asyncio.Event()
+        self.waiters = collections.deque()  # tickets in the order they are served
+
+    def sweep(self):
+        # files left by a previous run that crashed or was killed
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            print(f"removing orphaned scratch file {path}")
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                os.remove(path)
+
+    def ticket(self):
+        ticket = object()
+        self.waiters.append(ticket)
+        return ticket
+
+    def cancel(self, ticket):
+        # gives up a ticket that was not used, safe to call once it was
+        if ticket in self.waiters:
+            self.waiters.remove(ticket)
+            self.freed.set()
+
+    async def reserve(self, size, ticket=None, pinned=False):
+        if ticket is None or ticket not in self.waiters:
+            ticket = object()
+            self.waiters.appendleft(ticket)
+        try:
+            while self.waiters[0] is not ticket or (
+                self.used > self.pinned and self.used + size > self.quota
+            ):
+                self.freed.clear()
+                await self.freed.wait()
+        except BaseException:
+            self.cancel(ticket)
+            raise
+
+        self.waiters.popleft()
+        self.used += size
+        if pinned:
+            self.pinned += size
+        self.freed.set()  # the next ticket may fit as well
+        reservation = Reservation(self, size, pinned)
+        os.makedirs(reservation.directory, exist_ok=True)
+        return reservation
+
+    def _free(self, reservation):
+        self.used -= reservation.size
+        if reservation.pinned:
+            self.pinned -= reservation.size
+        self.freed.set()
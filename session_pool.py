@@ -0,0 +1,72 @@
+import asyncio
+import time
+
+from pyrogram.types import ChatPreview
+
+
+class SessionPool:
+    """
+    the main client and the helper accounts downloads are spread over
+
+    a helper is only used for the chats it joined, every client has its own
+    RateLimiter so a FloodWait only sets aside the account that got it.
+    uploads stay with the main client, the files it uploads are its own.
+    """
+
+    def __init__(self, main, helpers=()):
+        self.main = main
+        self.helpers = list(helpers)
+        self.members = {}  # chat id -> helpers that can read it
+        self.load = {main: 0}
+        self.started = asyncio.Event()
+
+    async def start(self):
+        results = await asyncio.gather(
+            *(helper.start() for helper in self.helpers), return_exceptions=True
+        )
+        for helper, result in zip(self.helpers[:], results):
+            if isinstance(result, BaseException):
+                print(f"helper session {helper.name} could not start: {result}")
+                self.helpers.remove(helper)
+                continue
+            self.load[helper] = 0
+        self.started.set()
+
+    async def stop(self):
+        for helper in self.helpers:
+            try:
+                await helper.stop()
+            except Exception as e:
+                print(f"helper session {helper.name} could not stop: {e}")
+
+    async def join(self, link, chat_id):
+        await self.started.wait()
+        members = []
+        for helper in self.helpers:
+            try:
+                chat = await helper.get_chat(link)
+                if isinstance(chat, ChatPreview):
+                    await helper.join_chat(link)
+                    chat = await helper.get_chat(link)
+            except Exception as e:
+                print(f"helper session {helper.name} can not read {link}: {e}")
+                continue
+            if chat.id == chat_id:
+                members.append(helper)
+
+        self.members[chat_id] = members
+        return members
+
+    def _paused(self, client):
+        state = client.limiter.classes.get("download")
+        return bool(state) and state["paused_until"] > time.monotonic()
+
+    def acquire(self, chat_id):
+        # the least busy client that can read the chat, paused ones last
+        clients = [self.main, *self.members.get(chat_id, [])]
+        client = min(clients, key=lambda c: (self._paused(c), self.load[c]))
+        self.load[client] += 1
+        return client
+
+    def release(self, client):
+        self.load[client] -= 1
@@ -0,0 +1,90 @@
+import asyncio
+import random
+import tempfile
+import unittest
+
+from pipeline import TransferPipeline
+from scratch import ScratchSpace
+
+
+class ScratchSpaceTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    async def test_reservations_follow_ticket_order(self):
+        scratch = ScratchSpace(self.directory.name, 10)
+        held = await scratch.reserve(8)
+        first, second = scratch.ticket(), scratch.ticket()
+        big = asyncio.create_task(scratch.reserve(5, first))
+        small = asyncio.create_task(scratch.reserve(1, second))
+        await asyncio.sleep(0.01)
+        # the small one would fit, but the big one holds the head of the queue
+        self.assertFalse(big.done())
+        self.assertFalse(small.done())
+
+        held.release()
+        await asyncio.wait_for(asyncio.gather(big, small), 1)
+        self.assertEqual(scratch.used, 6)
+
+    async def test_pinned_reservation_does_not_block_a_big_file(self):
+        scratch = ScratchSpace(self.directory.name, 10)
+        pinned = await scratch.reserve(2, pinned=True)
+        held = await scratch.reserve(1)
+        big = asyncio.create_task(scratch.reserve(10, scratch.ticket()))
+        await asyncio.sleep(0.01)
+        self.assertFalse(big.done())
+
+        # only the pinned one is left, the file may pass
+        held.release()
+        reservation = await asyncio.wait_for(big, 1)
+        reservation.release()
+        pinned.release()
+        self.assertEqual((scratch.used, scratch.pinned), (0, 0))
+
+    async def test_cancelled_ticket_lets_the_next_one_through(self):
+        scratch = ScratchSpace(self.directory.name, 10)
+        first, second = scratch.ticket(), scratch.ticket()
+        later = asyncio.create_task(scratch.reserve(1, second))
+        await asyncio.sleep(0.01)
+        self.assertFalse(later.done())
+
+        scratch.cancel(first)
+        reservation = await asyncio.wait_for(later, 1)
+        reservation.release()
+        self.assertEqual(scratch.used, 0)
+        self.assertFalse(scratch.waiters)
+
+    async def test_pipeline_does_not_deadlock_on_a_small_quota(self):
+        # items of mixed sizes whose total is far over the quota, a reservation
+        # taken out of order used to leave the head item waiting forever
+        scratch = ScratchSpace(self.directory.name, 12)
+        sizes = [5, 3] * 40
+        random.seed(1)
+        committed = []
+
+        async def download(size, ticket):
+            await asyncio.sleep(random.random() / 1000)
+            reservation = await scratch.reserve(size, ticket)
+            await asyncio.sleep(random.random() / 1000)
+            return reservation
+
+        async def commit(size, reservation, _):
+            committed.append(size)
+            reservation.release()
+
+        pipeline = TransferPipeline(
+            download=download,
+            commit=commit,
+            discard=lambda _, reservation: reservation.release(),
+            download_workers=6,
+            buffer_size=8,
+            take=lambda _: scratch.ticket(),
+        )
+        await asyncio.wait_for(pipeline.run(sizes), 10)
+        self.assertEqual(committed, sizes)
+        self.assertEqual(scratch.used, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import unittest
+
+from tracing import Tracer, current_task
+
+
+class TracerTest(unittest.TestCase):
+    def setUp(self):
+        token = current_task.set("1")
+        self.addCleanup(current_task.reset, token)
+
+    def test_overlapping_flood_waits_count_once(self):
+        tracer = Tracer("")
+        tracer.record("download_media", 1, 0, 10)
+        # three workers sleeping on the same FloodWait, then a later one
+        tracer.record("flood_wait", 1, 2, 4)
+        tracer.record("flood_wait", 2, 3, 4)
+        tracer.record("flood_wait", None, 2, 5)
+        tracer.record("flood_wait", 3, 8, 2)
+
+        profile = tracer.profile("1")
+        self.assertIn("flood_wait: 4,", profile)
+        self.assertIn("sleeping on FloodWaits: 7.0s, 70.0%", profile)
+
+    def test_memory_is_bounded(self):
+        tracer = Tracer("", max_tasks=2)
+        for _ in range(5000):
+            tracer.record("upload", 1, 0, 1)
+        stats = tracer.tasks["1"]["stages"]["upload"]
+        self.assertEqual((stats.count, stats.total), (5000, 5000))
+        self.assertEqual(len(stats.sample), stats.sample_size)
+
+        for task_id in ("2", "3"):
+            current_task.set(task_id)
+            tracer.record("upload", 1, 0, 1)
+        self.assertEqual(list(tracer.tasks), ["2", "3"])
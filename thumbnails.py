@@ -0,0 +1,33 @@
+from collections import OrderedDict
+
+
+class ThumbnailCache:
+    """
+    the thumbnails downloaded lately, keyed by file_unique_id
+
+    the least recently used ones are evicted once they take more than
+    `max_bytes` together.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.thumbs = OrderedDict()
+
+    def get(self, file_unique_id):
+        data = self.thumbs.get(file_unique_id)
+        if data is not None:
+            self.thumbs.move_to_end(file_unique_id)
+        return data
+
+    def put(self, file_unique_id, data):
+        if not file_unique_id or len(data) > self.max_bytes:
+            return
+        if file_unique_id in self.thumbs:
+            self.size -= len(self.thumbs.pop(file_unique_id))
+
+        self.thumbs[file_unique_id] = data
+        self.size += len(data)
+        while self.size > self.max_bytes:
+            _, evicted = self.thumbs.popitem(last=False)
+            self.size -= len(evicted)
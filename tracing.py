@@ -0,0 +1,150 @@
+import collections
+import json
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from logging.handlers import RotatingFileHandler
+
+# the id of the task a span belongs to, set when the task is created so the
+# pipeline workers and other tasks it starts inherit it
+current_task = ContextVar("current_task", default=None)
+
+
+def percentile(values, share):
+    # nearest rank of an already sorted list
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def timedelta_text(seconds):
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds // 60 % 60:02}:{seconds % 60:02}"
+
+
+def add_interval(intervals, start, end):
+    # merges [start, end] into a sorted list of disjoint intervals
+    merged = []
+    for interval in intervals:
+        if interval[1] < start or interval[0] > end:
+            merged.append(interval)
+        else:
+            start, end = min(start, interval[0]), max(end, interval[1])
+    merged.append((start, end))
+    merged.sort()
+    return merged
+
+
+class StageStats:
+    """the durations of one stage, percentiles come from a fixed size sample"""
+
+    def __init__(self, sample_size=1000):
+        self.sample_size = sample_size
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.sample = []
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.sample) < self.sample_size:
+            self.sample.append(seconds)
+        else:  # reservoir sampling, every duration has the same chance to stay
+            index = random.randrange(self.count)
+            if index < self.sample_size:
+                self.sample[index] = seconds
+
+
+class Tracer:
+    """
+    times the stages of every item, the spans are appended to a rotating
+    JSON Lines file and their durations kept per task for `profile`
+
+    a span is {"task", "item", "stage", "start", "seconds"}, start is a unix
+    time. spans may overlap, e.g. the thumbnail is fetched during a download.
+    only the `max_tasks` tasks that traced a span last are kept in memory.
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, backups=3, max_tasks=20):
+        self.max_tasks = max_tasks
+        # task id -> {"stages": {stage: StageStats}, "flood": [(start, end)],
+        # "first", "last"}, the least recently traced first
+        self.tasks = collections.OrderedDict()
+        self.logger = None
+        if path:
+            self.logger = logging.getLogger("pccs.trace")
+            self.logger.propagate = False
+            self.logger.setLevel(logging.INFO)
+            handler = RotatingFileHandler(
+                path, maxBytes=max_bytes, backupCount=backups, delay=True
+            )
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            self.logger.addHandler(handler)
+
+    @contextmanager
+    def span(self, stage, item=None):
+        start = time.time()
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.record(stage, item, start, time.monotonic() - started)
+
+    def record(self, stage, item, start, seconds):
+        task_id = current_task.get()
+        if task_id is not None:
+            task = self.tasks.get(task_id)
+            if task is None:
+                task = self.tasks[task_id] = {
+                    "stages": {},
+                    "flood": [],
+                    "first": start,
+                    "last": start,
+                }
+                if len(self.tasks) > self.max_tasks:
+                    self.tasks.popitem(last=False)
+            self.tasks.move_to_end(task_id)
+            task["stages"].setdefault(stage, StageStats()).add(seconds)
+            if stage == "flood_wait":
+                # the workers of a task often sleep on the same FloodWait
+                task["flood"] = add_interval(task["flood"], start, start + seconds)
+            task["first"] = min(task["first"], start)
+            task["last"] = max(task["last"], start + seconds)
+
+        if self.logger is not None:
+            self.logger.info(
+                json.dumps(
+                    {
+                        "task": task_id,
+                        "item": item,
+                        "stage": stage,
+                        "start": round(start, 3),
+                        "seconds": round(seconds, 4),
+                    }
+                )
+            )
+
+    def profile(self, task_id):
+        # the latency breakdown of a task as text, None if it has no spans
+        task = self.tasks.get(task_id)
+        if task is None:
+            return None
+
+        wall = max(task["last"] - task["first"], 1e-9)
+        lines = [
+            f"task {task_id}, {timedelta_text(wall)} traced",
+            "stage: count, p50 / p95 / max, total",
+        ]
+        for stage, stats in sorted(task["stages"].items()):
+            sample = sorted(stats.sample)
+            lines.append(
+                f"{stage}: {stats.count}, "
+                f"{percentile(sample, 0.5):.2f}s / {percentile(sample, 0.95):.2f}s"
+                f" / {stats.max:.2f}s, {stats.total:.1f}s"
+            )
+
+        flood = sum(end - start for start, end in task["flood"])
+        lines.append(f"sleeping on FloodWaits: {flood:.1f}s, {flood / wall:.1%}")
+        return "\n".join(lines)
@@ -0,0 +1,103 @@
+import sqlite3
+
+from pyrogram import raw
+
+
+class UploadCache:
+    """
+    the uploads already made, keyed by the file_unique_id of their source media
+
+    a cached upload is sent again by its server side id, without downloading
+    or uploading anything.
+    """
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS uploads (
+                file_unique_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                id INTEGER NOT NULL,
+                access_hash INTEGER NOT NULL,
+                file_reference BLOB NOT NULL
+            );
+            """
+        )
+
+    def get(self, file_unique_id):
+        if not file_unique_id:
+            return None
+        row = self.db.execute(
+            "SELECT kind, id, access_hash, file_reference FROM uploads WHERE file_unique_id = ?",
+            (file_unique_id,),
+        ).fetchone()
+        if row is None:
+            return None
+
+        kind, id, access_hash, file_reference = row
+        if kind == "photo":
+            return raw.types.InputMediaPhoto(
+                id=raw.types.InputPhoto(
+                    id=id, access_hash=access_hash, file_reference=file_reference
+                )
+            )
+        return raw.types.InputMediaDocument(
+            id=raw.types.InputDocument(
+                id=id, access_hash=access_hash, file_reference=file_reference
+            )
+        )
+
+    def add(self, file_unique_id, media):
+        if not file_unique_id or media is None:
+            return
+        kind = "photo" if isinstance(media, raw.types.InputMediaPhoto) else "document"
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?)",
+                (
+                    file_unique_id,
+                    kind,
+                    media.id.id,
+                    media.id.access_hash,
+                    media.id.file_reference,
+                ),
+            )
+
+    def forget(self, file_unique_id):
+        with self.db:
+            self.db.execute(
+                "DELETE FROM uploads WHERE file_unique_id = ?", (file_unique_id,)
+            )
+
+    def close(self):
+        self.db.close()
+
+
+def sent_media(updates):
+    # the input media of the message sent by a SendMedia call, it can be
+    # sent again to any chat by its server side id
+    for update in getattr(updates, "updates", []):
+        message = getattr(update, "message", None)
+        media = input_media(getattr(message, "media", None))
+        if media is not None:
+            return media
+
+
+def input_media(media):
+    if isinstance(media, raw.types.MessageMediaPhoto) and media.photo:
+        return raw.types.InputMediaPhoto(
+            id=raw.types.InputPhoto(
+                id=media.photo.id,
+                access_hash=media.photo.access_hash,
+                file_reference=media.photo.file_reference,
+            )
+        )
+    if isinstance(media, raw.types.MessageMediaDocument) and media.document:
+        return raw.types.InputMediaDocument(
+            id=raw.types.InputDocument(
+                id=media.document.id,
+                access_hash=media.document.access_hash,
+                file_reference=media.document.file_reference,
+            )
+        )
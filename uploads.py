@@ -0,0 +1,180 @@
+import asyncio
+import hashlib
+import math
+import os
+
+from pyrogram import raw
+from pyrogram.errors import FloodPremiumWait, FloodWait
+
+PART_SIZE = 512 * 1024
+BIG_FILE_SIZE = 10 * 1024 * 1024
+
+
+class PartUploader:
+    """
+    uploads the parts of one file while they are being written to it
+
+    a part is dropped once the server acknowledged it, only the ones that
+    failed are kept until `finish`, so they can be sent again without
+    reading the source twice.
+    """
+
+    def __init__(self, client, file_size, file_name, workers=4):
+        self.client = client
+        self.file_size = file_size
+        self.file_name = file_name
+        self.workers_count = workers
+
+        self.total_parts = math.ceil(file_size / PART_SIZE)
+        self.is_big = file_size > BIG_FILE_SIZE
+        self.file_id = client.rnd_id()
+        self.md5 = None if self.is_big else hashlib.md5()
+
+        self.parts = {}  # index -> bytes of the parts not acknowledged yet
+        self.parts_count = 0
+        self.failed = set()
+        self.written = 0
+        self.pending = bytearray()
+
+    async def __aenter__(self):
+        self.session = await self.client.media_session()
+        self.queue = asyncio.Queue(self.workers_count)
+        self.workers = [
+            asyncio.create_task(self._worker()) for _ in range(self.workers_count)
+        ]
+        return self
+
+    async def __aexit__(self, *exc):
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+        await self.session.stop()
+
+    def _rpc(self, index, data):
+        if self.is_big:
+            return raw.functions.upload.SaveBigFilePart(
+                file_id=self.file_id,
+                file_part=index,
+                file_total_parts=self.total_parts,
+                bytes=data,
+            )
+        return raw.functions.upload.SaveFilePart(
+            file_id=self.file_id, file_part=index, bytes=data
+        )
+
+    async def _read(self, index):
+        return self.parts[index]
+
+    async def _send(self, index):
+        # every part is paced by the client's limiter, a FloodWait pauses the
+        # uploads of every task instead of only this part
+        rpc = self._rpc(index, await self._read(index))
+        limiter = self.client.limiter
+        while True:
+            await limiter.acquire("upload")
+            try:
+                result = await self.session.invoke(rpc, sleep_threshold=0)
+            except (FloodWait, FloodPremiumWait) as e:
+                limiter.flood("upload", e.value)
+                continue
+            except Exception as e:
+                print(f"upload of part {index} failed: {e}")
+                return False
+            limiter.succeeded("upload")
+            return result
+
+    async def _worker(self):
+        while True:
+            index = await self.queue.get()
+            if index is None:
+                return
+            if await self._send(index):
+                self.parts.pop(index, None)
+            else:
+                self.failed.add(index)
+
+    async def _put_part(self, data):
+        index = self.parts_count
+        self.parts_count += 1
+        self.parts[index] = bytes(data)
+        if self.md5:
+            self.md5.update(data)
+        await self.queue.put(index)
+
+    async def write(self, chunk):
+        self.written += len(chunk)
+        self.pending += chunk
+        while len(self.pending) >= PART_SIZE:
+            await self._put_part(self.pending[:PART_SIZE])
+            del self.pending[:PART_SIZE]
+
+    async def finish(self, retries=3):
+        if self.pending:
+            await self._put_part(self.pending)
+            self.pending = bytearray()
+
+        if self.written != self.file_size or self.parts_count != self.total_parts:
+            raise ValueError(
+                f"{self.file_name}: got {self.written} of {self.file_size} bytes"
+            )
+        return await self._complete(retries)
+
+    async def _complete(self, retries):
+        # waits for the queued parts, sends the failed ones again and returns
+        # the InputFile of the upload
+        for _ in self.workers:
+            await self.queue.put(None)
+        await asyncio.gather(*self.workers)
+
+        for _ in range(retries):
+            for index in sorted(self.failed):
+                if await self._send(index):
+                    self.failed.discard(index)
+                    self.parts.pop(index, None)
+        if self.failed:
+            raise ConnectionError(
+                f"{self.file_name}: parts {sorted(self.failed)} could not be uploaded"
+            )
+
+        self.parts.clear()
+        if self.is_big:
+            return raw.types.InputFileBig(
+                id=self.file_id, parts=self.total_parts, name=self.file_name
+            )
+        return raw.types.InputFile(
+            id=self.file_id,
+            parts=self.total_parts,
+            name=self.file_name,
+            md5_checksum=self.md5.hexdigest(),
+        )
+
+
+class FileUploader(PartUploader):
+    """
+    uploads a file of the disk, `workers` parts at a time
+
+    unlike save_file, whose failed parts are only logged, the parts that
+    failed are read again and retried before the file is handed over.
+    """
+
+    def __init__(self, client, path, workers=4):
+        super().__init__(
+            client, os.path.getsize(path), os.path.basename(path), workers=workers
+        )
+        self.path = path
+
+    async def _read(self, index):
+        return await asyncio.to_thread(os.pread, self.fd, PART_SIZE, index * PART_SIZE)
+
+    async def upload(self, retries=3):
+        self.fd = os.open(self.path, os.O_RDONLY)
+        try:
+            if self.md5:
+                with open(self.path, "rb") as f:
+                    for data in iter(lambda: f.read(PART_SIZE), b""):
+                        self.md5.update(data)
+            for index in range(self.total_parts):
+                await self.queue.put(index)
+            return await self._complete(retries)
+        finally:
+            os.close(self.fd)